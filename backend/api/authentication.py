@@ -0,0 +1,116 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from users.models import User
+
+TOKEN_KEY = 'auth_token:{digest}'
+
+
+class LocalCache:
+    """Thread-safe LRU of values that expire after their ttl."""
+
+    def __init__(self, size_setting):
+        self.size_setting = size_setting
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > getattr(settings, self.size_setting):
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+
+local_tokens = LocalCache('TOKEN_CACHE_LOCAL_SIZE')
+
+
+def get_digest(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_token(key):
+    digest = get_digest(key)
+    local_tokens.delete(digest)
+    cache.delete(TOKEN_KEY.format(digest=digest))
+
+
+def invalidate_user_tokens(user_id):
+    for key in Token.objects.filter(user_id=user_id).values_list(
+            'key', flat=True):
+        invalidate_token(key)
+
+
+class CachedUser(SimpleLazyObject):
+    """
+    User of a cached token, loaded from the database on first use.
+
+    Id and active flag come from the token cache, so requests that only
+    need them don't query the user.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id, is_active):
+        super().__init__(lambda: User.objects.get(id=user_id))
+        self.__dict__.update(id=user_id, pk=user_id, is_active=is_active)
+
+    def __bool__(self):
+        # IsAuthenticated checks `request.user and ...`, which would
+        # otherwise load the user.
+        return True
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that caches the user id and active flag.
+
+    Entries are keyed by a digest of the token and kept in the shared
+    cache for TOKEN_CACHE_TIMEOUT seconds, and in a process-local LRU
+    for TOKEN_CACHE_LOCAL_TTL seconds in front of it. Logging out,
+    deleting a token and saving a user drop both entries in the current
+    process, other processes keep their local entry until its ttl runs
+    out. With a process-local default cache they also keep the shared
+    entry for up to TOKEN_CACHE_TIMEOUT.
+    """
+
+    def authenticate_credentials(self, key):
+        digest = get_digest(key)
+        cached = local_tokens.get(digest)
+        if cached is None:
+            cached = cache.get(TOKEN_KEY.format(digest=digest))
+            if cached is None:
+                user, _ = super().authenticate_credentials(key)
+                cached = (user.id, user.is_active)
+                cache.set(TOKEN_KEY.format(digest=digest), cached,
+                          settings.TOKEN_CACHE_TIMEOUT)
+            local_tokens.set(digest, cached, settings.TOKEN_CACHE_LOCAL_TTL)
+        user_id, is_active = cached
+        if not is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        return CachedUser(user_id, is_active), Token(key=key, user_id=user_id)
@@ -0,0 +1,490 @@
+"""
+Benchmarks run by the 'benchmark' management command.
+
+Every benchmark takes the size of its synthetic data set and the number
+of repeats, creates what it needs and prints its timings.
+"""
+import csv
+import io
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from base64 import b64encode
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.test.utils import override_settings
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from recipes import timeline as timelines
+from recipes.autocomplete import IngredientIndex
+from recipes.importers import import_ingredients, read_ingredients
+from recipes.matching import IngredientMatchIndex
+from recipes.models import (Ingredient, IngredientsInRecipe, Recipe, Tag,
+                            TimelineEntry)
+from recipes.search import recipe_search_index
+from users.models import Subscription, User
+
+from .fields import Base64ImageField
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .representations import RecipeRepresentation, SubscriptionRepresentation
+from .serializers import RecipeSerializer, ShowSubscriptionsSerializer
+from .views import get_recipe_queryset, get_recipe_rows, get_subscription_rows
+
+BENCHMARKS = {}
+ADJECTIVES = ('красный', 'сушёный', 'молотый', 'свежий', 'копчёный',
+              'морской', 'тёмный', 'зелёный', 'сладкий', 'острый')
+NOUNS = ('перец', 'соль', 'сахар', 'лук', 'чеснок', 'укроп', 'сыр',
+         'ёжевика', 'свёкла', 'фасоль', 'мука', 'масло')
+
+
+def benchmark(name, size):
+    """Registers a benchmark under `name` with a default data size."""
+    def register(function):
+        BENCHMARKS[name] = (function, size)
+        return function
+    return register
+
+
+def measure(function, repeat):
+    """Timings of `repeat` calls in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f'{label}: median {statistics.median(timings) * 1000:.3f} ms, '
+          f'p99 {p99 * 1000:.3f} ms, n={len(timings)}')
+
+
+def create_users(count, prefix='user'):
+    User.objects.bulk_create(
+        User(username=f'{prefix}{number}',
+             email=f'{prefix}{number}@example.org',
+             first_name='User', last_name=str(number))
+        for number in range(count))
+    return list(User.objects.filter(username__startswith=prefix)
+                .order_by('id'))
+
+
+def create_recipes(size, authors, prefix='Recipe'):
+    Recipe.objects.bulk_create(
+        (Recipe(name=f'{prefix} {number}', text='Text', cooking_time=10,
+                image='recipes/images/recipe.png',
+                author=authors[number % len(authors)])
+         for number in range(size)),
+        batch_size=1000)
+    return list(Recipe.objects.filter(name__startswith=prefix)
+                .order_by('pub_date', 'id'))
+
+
+def get_client(user=None):
+    client = APIClient()
+    if user is not None:
+        client.force_authenticate(user)
+    return client
+
+
+def get(client, path, params=None):
+    """A response that is not served from the cache."""
+    cache.clear()
+    response = client.get(path, params)
+    assert response.status_code == 200, response.content
+    return response
+
+
+def add_recipe_details(recipes, tag_count=3, ingredient_count=5):
+    """Gives every recipe the same few tags and ingredients."""
+    Tag.objects.bulk_create(
+        Tag(name=f'Тег {number}', color=f'#{number:06x}',
+            slug=f'tag{number}')
+        for number in range(tag_count))
+    tags = list(Tag.objects.filter(slug__startswith='tag'))
+    Ingredient.objects.bulk_create(
+        Ingredient(name=name, measurement_unit='г')
+        for name in get_ingredient_names(ingredient_count))
+    ingredients = list(Ingredient.objects.order_by('-id')[:ingredient_count])
+    Recipe.tags.through.objects.bulk_create(
+        (Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+         for recipe in recipes for tag in tags),
+        batch_size=1000)
+    IngredientsInRecipe.objects.bulk_create(
+        (IngredientsInRecipe(recipe=recipe, ingredients=ingredient,
+                             amount=100)
+         for recipe in recipes for ingredient in ingredients),
+        batch_size=1000)
+
+
+def get_request(user, path='/api/recipes/', params=None):
+    request = Request(APIRequestFactory().get(path, params))
+    request.user = user
+    return request
+
+
+def get_ingredient_names(count, seed=0):
+    rng = random.Random(seed)
+    for number in range(count):
+        yield (f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} '
+               f'{rng.choice(NOUNS)} {number}').capitalize()
+
+
+@benchmark('autocomplete', 1_000_000)
+def autocomplete(size, repeat):
+    rows = [(pk, name, 'г')
+            for pk, name in enumerate(get_ingredient_names(size))]
+    start = time.perf_counter()
+    index = IngredientIndex(rows)
+    print(f'Index of {size} ingredients built in '
+          f'{time.perf_counter() - start:.1f} s')
+    rng = random.Random(1)
+    queries = {
+        'prefix': [name.lower()[:rng.randint(2, 8)]
+                   for _, name, _ in rng.sample(rows, 200)],
+        'word start': [rng.choice(NOUNS)[:3] for _ in range(200)],
+        'trigram': ['перцц', 'сахр', 'чесонк', 'ежевка', 'свекал'] * 40,
+    }
+    for kind, words in queries.items():
+        timings = []
+        for word in words:
+            timings.extend(measure(lambda: index.search(word, 20), repeat))
+        report(f'{kind} search', timings)
+    timings = measure(lambda: index.add(size, 'Новый перец', 'г'), repeat)
+    report('add', timings)
+    timings = measure(lambda: index.remove(size), repeat)
+    report('remove', timings)
+
+
+@benchmark('pagination', 100_000)
+def pagination(size, repeat):
+    recipes = create_recipes(size, create_users(10, 'author'))
+    page_size = 6
+    page = min(1000, size // page_size)
+    client = get_client()
+    keyset = KeysetPagination()
+    keyset.base_url = f'/api/recipes/?limit={page_size}'
+    cursor = keyset.encode_cursor(recipes[(page - 1) * page_size - 1],
+                                  reverse=False)
+    report(f'offset page {page}', measure(
+        lambda: get(client, '/api/recipes/',
+                    {'page': page, 'limit': page_size}), repeat))
+    report(f'cursor page {page}', measure(
+        lambda: get(client, cursor), repeat))
+
+
+@benchmark('batch', 100)
+def batch(size, repeat):
+    user = create_users(1, 'reader')[0]
+    ids = [recipe.id for recipe in
+           create_recipes(size, create_users(10, 'author'))]
+    client = get_client(user)
+    for name in ('favorite', 'shopping_cart'):
+        batch_url = f'/api/recipes/{name}/batch/'
+
+        def add_batch():
+            response = client.post(batch_url, {'ids': ids}, format='json')
+            assert response.status_code == 200, response.content
+
+        def add_singly():
+            for pk in ids:
+                response = client.post(f'/api/recipes/{pk}/{name}/')
+                assert response.status_code == 201, response.content
+
+        for label, add in (('batch', add_batch), ('single', add_singly)):
+            timings = []
+            for _ in range(repeat):
+                timings.extend(measure(add, 1))
+                client.delete(batch_url, {'ids': ids}, format='json')
+            report(f'{name} {label} of {size}', timings)
+            print(f'{name} {label}: '
+                  f'{size / statistics.median(timings):.0f} recipes/s')
+
+
+def get_png(size):
+    """PNG of random pixels about `size` bytes large."""
+    side = int((size / 3) ** 0.5)
+    buffer = io.BytesIO()
+    Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(
+        buffer, 'PNG', compress_level=0)
+    return buffer.getvalue()
+
+
+@benchmark('image_upload', 50)
+def image_upload(size, repeat):
+    megabyte = 1024 * 1024
+    for megabytes in sorted({1, 10, size}):
+        content = get_png(megabytes * megabyte)
+        data = f'data:image/png;base64,{b64encode(content).decode()}'
+        peaks = []
+
+        def decode():
+            tracemalloc.start()
+            try:
+                Base64ImageField().to_internal_value(data).close()
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+
+        with override_settings(IMAGE_UPLOAD_MAX_SIZE=len(content)):
+            timings = measure(decode, repeat)
+        report(f'{len(content) / megabyte:.0f} MB data URI', timings)
+        print(f'{len(content) / megabyte:.0f} MB data URI: peak traced '
+              f'memory {max(peaks) / megabyte:.2f} MB')
+
+
+@benchmark('search', 100_000)
+def search(size, repeat):
+    authors = create_users(10, 'author')
+    create_recipes(size, authors)
+    rare_author = create_users(1, 'rare')[0]
+    create_recipes(max(1, size // 1000), [rare_author], 'Rare recipe')
+    recipe_search_index.invalidate()
+    start = time.perf_counter()
+    recipe_search_index.index.get()
+    print(f'Search index of {size} recipes built in '
+          f'{time.perf_counter() - start:.1f} s')
+    client = get_client()
+    for label, params in (
+            ('all recipes', {}),
+            ('one of 10 authors', {'author': authors[0].id}),
+            ('author of 0.1%', {'author': rare_author.id})):
+        for query in ('recipe', 'recipe 5'):
+            report(f'search {query!r}, {label}', measure(
+                lambda: get(client, '/api/recipes/',
+                            {'search': query, **params}), repeat))
+
+
+@benchmark('matching', 100_000)
+def matching(size, repeat):
+    rng = random.Random(0)
+    ingredient_ids = range(2000)
+    rows = [(recipe_id, ingredient_id) for recipe_id in range(size)
+            for ingredient_id in rng.sample(ingredient_ids, 8)]
+    index = IngredientMatchIndex(rows)
+    queries = [rng.sample(ingredient_ids, 5) for _ in range(100)]
+    timings = []
+    for query in queries:
+        timings.extend(measure(lambda: index.match(query, 20), repeat))
+    report('match', timings)
+    report('set recipe', measure(
+        lambda: index.set_recipe(rng.randrange(size),
+                                 rng.sample(ingredient_ids, 8)), repeat))
+    report('add recipe', measure(
+        lambda: index.set_recipe(size + rng.randrange(size),
+                                 rng.sample(ingredient_ids, 8)), repeat))
+    report('remove recipe', measure(
+        lambda: index.remove_recipe(rng.randrange(size)), repeat))
+
+
+@benchmark('tags', 100_000)
+def tags(size, repeat):
+    recipes = create_recipes(size, create_users(10, 'author'))
+    Tag.objects.bulk_create(
+        Tag(name=f'Tag {number}', color=f'#{number:06x}',
+            slug=f'tag{number}')
+        for number in range(10))
+    tag_ids = list(Tag.objects.filter(slug__startswith='tag')
+                   .values_list('id', flat=True))
+    rng = random.Random(0)
+    Recipe.tags.through.objects.bulk_create(
+        (Recipe.tags.through(recipe_id=recipe.id, tag_id=tag_id)
+         for recipe in recipes
+         for tag_id in rng.sample(tag_ids, rng.randint(1, 3))),
+        batch_size=1000)
+    client = get_client()
+    for label, params in (
+            ('one tag', {'tags': ['tag0']}),
+            ('two tags, any', {'tags': ['tag0', 'tag1']}),
+            ('two tags, all', {'tags': ['tag0', 'tag1'],
+                               'tags_mode': 'all'}),
+            ('five tags, any', {'tags': [f'tag{n}' for n in range(5)]}),
+            ('five tags, any, cursor', {
+                'tags': [f'tag{n}' for n in range(5)],
+                'pagination': 'cursor'})):
+        report(label, measure(
+            lambda: get(client, '/api/recipes/', params), repeat))
+
+
+@benchmark('timeline', 1000)
+def timeline(size, repeat):
+    popular, small, filler = create_users(3, 'author')
+    followers = create_users(min(size, settings.TIMELINE_FANOUT_LIMIT),
+                             'follower')
+    Subscription.objects.bulk_create(
+        [Subscription(subscriber=user, subscription=popular)
+         for user in followers]
+        + [Subscription(subscriber=user, subscription=small)
+           for user in followers[:10]])
+    recipes = create_recipes(settings.TIMELINE_MAX_SIZE, [filler], 'Filler')
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user=user, recipe=recipe, author=filler,
+                       pub_date=recipe.pub_date - timedelta(minutes=number))
+         for user in followers
+         for number, recipe in enumerate(reversed(recipes))),
+        batch_size=1000)
+    print(f'{len(followers)} followers with full timelines of '
+          f'{len(recipes)} entries')
+    for label, author in (('popular author', popular),
+                          ('author of 10', small)):
+        new_recipes = create_recipes(repeat, [author], f'New {label}')
+        timings = []
+        for recipe in new_recipes:
+            timings.extend(measure(lambda: timelines.push_recipe(recipe), 1))
+        report(f'push, {label}', timings)
+    client = get_client(followers[0])
+    report('feed', measure(
+        lambda: get(client, '/api/recipes/feed/'), repeat))
+
+
+def write_catalogue(rows, file_format):
+    file = io.StringIO()
+    if file_format == 'csv':
+        csv.writer(file).writerows(rows)
+    elif file_format == 'json':
+        json.dump([{'name': name, 'measurement_unit': unit}
+                   for name, unit in rows], file, ensure_ascii=False)
+    else:
+        for name, unit in rows:
+            file.write(json.dumps({'name': name, 'measurement_unit': unit},
+                                  ensure_ascii=False) + '\n')
+    return file.getvalue()
+
+
+@benchmark('ingredient_import', 100_000)
+def ingredient_import(size, repeat):
+    for file_format in ('csv', 'json', 'ndjson'):
+        content = write_catalogue(
+            [(f'{name} {file_format}', 'г')
+             for name in get_ingredient_names(size)], file_format)
+
+        def read():
+            return sum(1 for _ in read_ingredients(io.StringIO(content),
+                                                   file_format))
+
+        def load():
+            for _ in import_ingredients(
+                    read_ingredients(io.StringIO(content), file_format),
+                    5000):
+                pass
+
+        report(f'{file_format} parse', measure(read, repeat))
+        for label in ('import', 'repeated import'):
+            timings = measure(load, 1)
+            report(f'{file_format} {label}', timings)
+            print(f'{file_format} {label}: {size / timings[0]:.0f} rows/s')
+
+
+@benchmark('renderer', 500)
+def renderer(size, repeat):
+    recipes = create_recipes(size, create_users(10, 'author'),
+                             'Борщ «домашний»\u2028')
+    add_recipe_details(recipes)
+    user = User.objects.first()
+    request = get_request(user)
+    queryset = get_recipe_queryset(user, Recipe.objects.filter(
+        id__in=[recipe.id for recipe in recipes])).order_by('pub_date', 'id')
+    for count in (6, 50, size):
+        results = RecipeSerializer(queryset[:count], many=True,
+                                   context={'request': request}).data
+        page = {'count': count, 'next': None, 'previous': None,
+                'results': results}
+        assert FastJSONRenderer().render(page) == JSONRenderer().render(page)
+        medians = {}
+        for encoder in (JSONRenderer(), FastJSONRenderer()):
+            timings = measure(lambda: encoder.render(page), repeat)
+            report(f'{count} items, {type(encoder).__name__}', timings)
+            medians[type(encoder)] = statistics.median(timings)
+        print(f'{count} items: {len(JSONRenderer().render(page))} bytes, '
+              f'{medians[JSONRenderer] / medians[FastJSONRenderer]:.1f}x '
+              'faster')
+
+
+@benchmark('representation', 1000)
+def representation(size, repeat):
+    authors = create_users(50, 'author')
+    recipes = create_recipes(size, authors)
+    add_recipe_details(recipes)
+    user = create_users(1, 'reader')[0]
+    Subscription.objects.bulk_create(
+        Subscription(subscriber=user, subscription=author)
+        for author in authors)
+    recipe_ids = [recipe.id for recipe in recipes]
+    request = get_request(user)
+
+    def serialize_recipes():
+        return RecipeSerializer(
+            get_recipe_queryset(user, Recipe.objects.filter(
+                id__in=recipe_ids)).order_by('pub_date', 'id'),
+            many=True, context={'request': request}).data
+
+    def represent_recipes():
+        return RecipeRepresentation(
+            get_recipe_rows(user, Recipe.objects.filter(
+                id__in=recipe_ids)).order_by('pub_date', 'id'),
+            many=True, context={'request': request}).data
+
+    def serialize_subscriptions():
+        return ShowSubscriptionsSerializer(
+            User.objects.filter(subscription__subscriber=user).annotate(
+                recipes_count=Count('my_recipes')).order_by('username'),
+            many=True, context={'request': request}).data
+
+    def represent_subscriptions():
+        return SubscriptionRepresentation(
+            get_subscription_rows(user), many=True,
+            context={'request': request}).data
+
+    for label, serialize, represent in (
+            ('recipes', serialize_recipes, represent_recipes),
+            ('subscriptions', serialize_subscriptions,
+             represent_subscriptions)):
+        assert (json.dumps(serialize(), sort_keys=True)
+                == json.dumps(represent(), sort_keys=True)), label
+        medians = {}
+        for name, function in (('serializer', serialize),
+                               ('value rows', represent)):
+            timings = measure(function, repeat)
+            report(f'{label}, {name}, {size} recipes', timings)
+            medians[name] = statistics.median(timings)
+        print(f'{label}: per 1,000 recipes '
+              f'{medians["serializer"] * 1000 ** 2 / size:.1f} -> '
+              f'{medians["value rows"] * 1000 ** 2 / size:.1f} ms, '
+              f'{medians["serializer"] / medians["value rows"]:.1f}x faster')
+
+
+@benchmark('sparse_fields', 10_000)
+def sparse_fields(size, repeat):
+    authors = create_users(50, 'author')
+    add_recipe_details(create_recipes(size, authors), 3, 8)
+    user = create_users(1, 'reader')[0]
+    Subscription.objects.bulk_create(
+        Subscription(subscriber=user, subscription=author)
+        for author in authors)
+    client = get_client(user)
+    for path, label, params in (
+            ('/api/recipes/', 'full', {}),
+            ('/api/recipes/', 'card', {'representation': 'card'}),
+            ('/api/recipes/', 'omit ingredients', {'omit': 'ingredients'}),
+            ('/api/recipes/', 'id and name', {'fields': 'id,name'}),
+            ('/api/users/subscriptions/', 'full', {'recipes_limit': 3}),
+            ('/api/users/subscriptions/', 'omit recipes',
+             {'omit': 'recipes'})):
+        for limit in (6, 50):
+            params = {**params, 'limit': limit}
+            payload = len(get(client, path, params).content)
+            report(f'{path} {label}, {limit} items, {payload} bytes', measure(
+                lambda: get(client, path, params), repeat))
@@ -0,0 +1,220 @@
+import hashlib
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from recipes.models import Favorite, ShoppingCart, Tag
+from users.models import Subscription
+
+REFERENCE_KEY = 'reference:{scope}'
+RESPONSE_KEY = 'reference:{scope}:{digest}'
+TAG_IDS_KEY = 'reference:tags:ids:{version}'
+
+
+def get_reference_version(scope):
+    """Current (version, last modified timestamp) of the reference data."""
+    return cache.get_or_set(REFERENCE_KEY.format(scope=scope),
+                            lambda: (uuid4().hex, int(time.time())),
+                            timeout=None)
+
+
+def invalidate_reference(scope):
+    cache.set(REFERENCE_KEY.format(scope=scope),
+              (uuid4().hex, int(time.time())), timeout=None)
+
+
+def get_tag_ids():
+    """Cached {slug: id} map of all tags."""
+    version, _ = get_reference_version('tags')
+    return cache.get_or_set(
+        TAG_IDS_KEY.format(version=version),
+        lambda: dict(Tag.objects.values_list('slug', 'id')),
+        settings.REFERENCE_CACHE_TIMEOUT
+    )
+
+
+class ReferenceCacheMixin:
+    """
+    Caches serialized list and detail responses of read-only viewsets.
+
+    Responses carry ETag and Last-Modified headers, so clients can
+    revalidate with a 304 response. The cache is keyed on a version that
+    is replaced whenever the underlying data changes.
+    """
+    cache_scope = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args,
+                                    **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        version, last_modified = get_reference_version(self.cache_scope)
+        digest = hashlib.md5(
+            f'{version}:{request.get_full_path()}'.encode()).hexdigest()
+        etag = f'"{digest}"'
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+        key = RESPONSE_KEY.format(scope=self.cache_scope, digest=digest)
+        data = cache.get(key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            data = response.data
+            cache.set(key, data, settings.REFERENCE_CACHE_TIMEOUT)
+        response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+RECIPE_FEED_SCOPE = 'recipes'
+POPULARITY_SCOPE = 'recipes:popularity'
+POPULAR_ORDERINGS = ('popular', '-popular')
+RECIPE_FEED_KEY = 'recipe_feed:{digest}'
+RECIPE_FEED_STAT_KEY = 'recipe_feed:stats:{name}'
+PRIVATE_FILTERS = ('is_favorited', 'is_in_shopping_cart')
+
+
+def invalidate_recipe_feed():
+    transaction.on_commit(lambda: invalidate_reference(RECIPE_FEED_SCOPE))
+
+
+def invalidate_popularity():
+    """Drops cached pages ordered by popularity counters."""
+    transaction.on_commit(lambda: invalidate_reference(POPULARITY_SCOPE))
+
+
+def increment_feed_stat(name, delta=1):
+    key = RECIPE_FEED_STAT_KEY.format(name=name)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, timeout=None)
+
+
+def get_feed_stats():
+    stats = cache.get_many([RECIPE_FEED_STAT_KEY.format(name=name)
+                            for name in ('hits', 'misses', 'saved_db_us')])
+    hits, misses, saved_db_us = (
+        stats.get(RECIPE_FEED_STAT_KEY.format(name=name), 0)
+        for name in ('hits', 'misses', 'saved_db_us')
+    )
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else 0,
+        'saved_db_time': saved_db_us / 10 ** 6,
+    }
+
+
+class QueryTimer:
+    """Database execute wrapper that sums up time spent in queries."""
+
+    def __init__(self):
+        self.elapsed = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+class RecipeFeedCacheMixin:
+    """
+    Caches the shared part of recipe list pages.
+
+    Pages are serialized as for an anonymous user and cached under the
+    feed version, then per-user flags present in the page are overlaid
+    on every request. Filters that depend on the user bypass the cache.
+    Pages ordered by popularity are also keyed on the counters version,
+    which favorite and shopping cart changes replace.
+    """
+    shared_page = False
+
+    def list(self, request, *args, **kwargs):
+        if any(name in request.query_params for name in PRIVATE_FILTERS):
+            return super().list(request, *args, **kwargs)
+        version, _ = get_reference_version(RECIPE_FEED_SCOPE)
+        if request.query_params.get('ordering') in POPULAR_ORDERINGS:
+            popularity_version, _ = get_reference_version(POPULARITY_SCOPE)
+            version = f'{version}:{popularity_version}'
+        digest = hashlib.md5(
+            f'{version}:{request.get_host()}:{request.get_full_path()}'
+            .encode()
+        ).hexdigest()
+        key = RECIPE_FEED_KEY.format(digest=digest)
+        cached = cache.get(key)
+        if cached is None:
+            timer = QueryTimer()
+            self.shared_page = True
+            try:
+                with connection.execute_wrapper(timer):
+                    response = super().list(request, *args, **kwargs)
+            finally:
+                self.shared_page = False
+            if response.status_code != 200:
+                return response
+            cached = (response.data, int(timer.elapsed * 10 ** 6))
+            cache.set(key, cached, settings.RECIPE_FEED_CACHE_TIMEOUT)
+            increment_feed_stat('misses')
+        else:
+            increment_feed_stat('hits')
+            increment_feed_stat('saved_db_us', cached[1])
+        data = cached[0]
+        if request.user.is_authenticated:
+            data = dict(data)
+            data['results'] = self.overlay_user_flags(data['results'],
+                                                      request.user)
+        return Response(data)
+
+    def overlay_user_flags(self, results, user):
+        if not results:
+            return results
+        recipe_ids = [recipe['id'] for recipe in results]
+        overlays = {}
+        if 'is_favorited' in results[0]:
+            overlays['is_favorited'] = set(Favorite.objects.filter(
+                owner_id=user.id, favorite_id__in=recipe_ids
+            ).values_list('favorite_id', flat=True))
+        if 'is_in_shopping_cart' in results[0]:
+            overlays['is_in_shopping_cart'] = set(
+                ShoppingCart.objects.filter(
+                    customer_id=user.id, purchase_id__in=recipe_ids
+                ).values_list('purchase_id', flat=True))
+        subscribed = None
+        if 'author' in results[0]:
+            subscribed = set(Subscription.objects.filter(
+                subscriber_id=user.id,
+                subscription_id__in={
+                    recipe['author']['id'] for recipe in results}
+            ).values_list('subscription_id', flat=True))
+        overlaid = []
+        for recipe in results:
+            recipe = {
+                **recipe,
+                **{flag: recipe['id'] in ids
+                   for flag, ids in overlays.items()},
+            }
+            if subscribed is not None:
+                recipe['author'] = {
+                    **recipe['author'],
+                    'is_subscribed': recipe['author']['id'] in subscribed,
+                }
+            overlaid.append(recipe)
+        return overlaid
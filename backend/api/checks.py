@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Warns when cached responses can't be invalidated across processes.
+
+    Tag, ingredient and recipe feed caches are invalidated by management
+    commands and the image worker too, which never reach a cache local
+    to the web worker process.
+    """
+    if settings.CACHES['default']['BACKEND'] not in LOCAL_CACHES:
+        return []
+    return [Warning(
+        'The default cache is local to the process, invalidation from '
+        'management commands and other workers is not seen by the web '
+        'server until the cached responses expire.',
+        hint='Set CACHE_BACKEND=redis to share the cache between '
+             'processes.',
+        id='api.W001',
+    )]
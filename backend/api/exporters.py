@@ -0,0 +1,123 @@
+import csv
+from html import escape
+
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.negotiation import DefaultContentNegotiation
+
+from recipes.models import ShoppingListItem
+
+CHUNK_SIZE = 2000
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+def get_shopping_list(user):
+    """Precomputed ingredient totals for the user's shopping cart."""
+    return ShoppingListItem.objects.filter(user_id=user.id).order_by(
+        'ingredient__name', 'ingredient'
+    ).values_list(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'total_amount'
+    )
+
+
+class ExportUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Export in this format is unavailable.'
+    default_code = 'export_unavailable'
+
+
+class ExportContentNegotiation(DefaultContentNegotiation):
+    """Leaves ?format= to the exporters and renders errors as JSON."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return super().select_renderer(request, renderers, 'json')
+
+
+class Echo:
+    """File-like object that returns written value instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListExporter:
+    """Base class for shopping list renderers."""
+    content_type = 'text/plain'
+    extension = 'txt'
+    title = 'Shopping List'
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def rows(self):
+        return self.queryset.iterator(chunk_size=CHUNK_SIZE)
+
+    def render(self):
+        raise NotImplementedError
+
+    def get_response(self):
+        response = StreamingHttpResponse(self.render(),
+                                         content_type=self.content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename=shopping.{self.extension}'
+        )
+        return response
+
+
+class TextExporter(ShoppingListExporter):
+    content_type = 'text/plain; charset=utf-8'
+
+    def render(self):
+        yield f'{self.title}:\n'
+        for name, measurement_unit, amount in self.rows():
+            yield f'{name} - {amount} {measurement_unit}\n'
+
+
+class CSVExporter(ShoppingListExporter):
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def render(self):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('name', 'amount', 'measurement_unit'))
+        for name, measurement_unit, amount in self.rows():
+            yield writer.writerow((name, amount, measurement_unit))
+
+
+class PDFExporter(ShoppingListExporter):
+    """
+    Renders the list with WeasyPrint.
+
+    The layout engine needs the whole document, so rows are still read
+    from a server-side cursor but the PDF is rendered before the response
+    starts and then sent in chunks. A missing WeasyPrint or system
+    library is reported with 503 instead of a truncated file.
+    """
+    content_type = 'application/pdf'
+    extension = 'pdf'
+
+    def html(self):
+        yield f'<html><body><h1>{self.title}</h1><ul>'
+        for name, measurement_unit, amount in self.rows():
+            yield (f'<li>{escape(name)} - {amount} '
+                   f'{escape(measurement_unit)}</li>')
+        yield '</ul></body></html>'
+
+    def render(self):
+        try:
+            from weasyprint import HTML
+        except (ImportError, OSError):
+            raise ExportUnavailable('PDF export is unavailable.')
+        document = HTML(string=''.join(self.html())).write_pdf()
+        return [document[start:start + PDF_CHUNK_SIZE]
+                for start in range(0, len(document), PDF_CHUNK_SIZE)]
+
+
+EXPORTERS = {
+    'txt': TextExporter,
+    'csv': CSVExporter,
+    'pdf': PDFExporter,
+}
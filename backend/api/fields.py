@@ -1,13 +1,109 @@
-import base64
+import binascii
+from base64 import b64decode
+from tempfile import SpooledTemporaryFile
+from uuid import uuid4
 
-from django.core.files.base import ContentFile
-from rest_framework.serializers import ImageField
+from django.conf import settings
+from django.core.files import File
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import FileField, ImageField
+
+DATA_URI_PREFIX = 'data:image'
+BASE64_MARKER = ';base64,'
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+def sniff_image_format(header):
+    """Image format detected from the file's magic bytes."""
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
 
 
 class Base64ImageField(ImageField):
+    """
+    Image sent as a data URI or a multipart upload.
+
+    The data URI payload is decoded chunk by chunk into a spooled temporary
+    file, so it is never held in memory twice, and its size is checked
+    before decoding. Pillow only verifies the file structure of either,
+    decoding and resizing the image are left to the image worker.
+    """
+    default_error_messages = {
+        'invalid_base64': 'Invalid base64 image data.',
+        'too_large': 'Image should not be larger than {max_size} bytes.',
+        'unsupported': 'Unsupported image format.',
+    }
+
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        return super().to_internal_value(data)
+        if isinstance(data, str) and data.startswith(DATA_URI_PREFIX):
+            return FileField.to_internal_value(self, self.decode(data))
+        file = FileField.to_internal_value(self, data)
+        max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+        if file.size > max_size:
+            self.fail('too_large', max_size=max_size)
+        self.verify(file)
+        return file
+
+    def verify(self, file):
+        """Image format sniffed from the file, once Pillow accepts it."""
+        file.seek(0)
+        extension = sniff_image_format(file.read(16))
+        if extension is None:
+            self.fail('unsupported')
+        file.seek(0)
+        try:
+            with Image.open(file) as image:
+                image.verify()
+        except Exception:
+            self.fail('invalid_image')
+        file.seek(0)
+        return extension
+
+    def decode(self, data):
+        start = data.find(BASE64_MARKER)
+        if start == -1:
+            self.fail('invalid_base64')
+        start += len(BASE64_MARKER)
+        max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+        if (len(data) - start) // 4 * 3 > max_size + 2:
+            self.fail('too_large', max_size=max_size)
+        file = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        try:
+            size = self.write_chunks(data, start, file)
+        except (binascii.Error, ValueError):
+            file.close()
+            self.fail('invalid_base64')
+        if size > max_size:
+            file.close()
+            self.fail('too_large', max_size=max_size)
+        try:
+            extension = self.verify(file)
+        except ValidationError:
+            file.close()
+            raise
+        return File(file, name=f'{uuid4().hex}.{extension}')
+
+    def write_chunks(self, data, start, file):
+        size = 0
+        rest = ''
+        for position in range(start, len(data), CHUNK_SIZE):
+            chunk = rest + ''.join(
+                data[position:position + CHUNK_SIZE].split())
+            cut = len(chunk) - len(chunk) % 4
+            rest = chunk[cut:]
+            size += file.write(b64decode(chunk[:cut], validate=True))
+        if rest:
+            raise ValueError('Incorrect padding.')
+        return size
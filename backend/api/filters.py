@@ -1,30 +1,87 @@
+from django import forms
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet
-from django_filters.rest_framework.filters import (AllValuesMultipleFilter,
-                                                   BooleanFilter)
-from rest_framework.filters import SearchFilter
+from django_filters.rest_framework.filters import (BooleanFilter, CharFilter,
+                                                   ChoiceFilter, Filter)
+from rest_framework.exceptions import ValidationError
 
 from recipes.models import Recipe
+from recipes.search import search_recipes
 
+from .cache import get_tag_ids
+from .pagination import CustomPagination
 
-class IngredientFilter(SearchFilter):
-    search_param = 'name'
+TAGS_MODES = (('any', 'Any of the tags'), ('all', 'All of the tags'))
+ORDERINGS = {
+    'popular': ('favorites_count', 'in_carts_count', 'id'),
+    '-popular': ('-favorites_count', '-in_carts_count', '-id'),
+}
+
+
+class SlugListField(forms.Field):
+    widget = forms.SelectMultiple
+
+    def to_python(self, value):
+        return [slug for slug in value or () if slug]
+
+
+class SlugListFilter(Filter):
+    field_class = SlugListField
 
 
 class RecipeFilter(FilterSet):
-    tags = AllValuesMultipleFilter(field_name='tags__slug')
+    tags = SlugListFilter(method='get_tags')
+    tags_mode = ChoiceFilter(choices=TAGS_MODES, method='get_tags_mode')
     is_favorited = BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = BooleanFilter(method='get_is_in_shopping_cart')
+    search = CharFilter(method='get_search')
+    ordering = ChoiceFilter(
+        choices=[(ordering, ordering) for ordering in ORDERINGS],
+        method='get_ordering'
+    )
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'tags_mode', 'is_favorited',
+                  'is_in_shopping_cart', 'search', 'ordering')
+
+    def get_tags(self, queryset, name, value):
+        tag_ids = get_tag_ids()
+        found = {tag_ids[slug] for slug in value if slug in tag_ids}
+        mode = self.form.cleaned_data.get('tags_mode') or 'any'
+        if not found or mode == 'all' and len(found) < len(set(value)):
+            return queryset.none()
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'))
+        if mode == 'any':
+            return queryset.filter(Exists(recipe_tags.filter(
+                tag_id__in=found)))
+        for tag_id in found:
+            queryset = queryset.filter(Exists(recipe_tags.filter(
+                tag_id=tag_id)))
+        return queryset
+
+    def get_tags_mode(self, queryset, name, value):
+        return queryset
 
     def get_is_favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(favorite__owner=self.request.user)
+            return queryset.filter(favorite__owner_id=self.request.user.id)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(shopping_cart__customer=self.request.user)
+            return queryset.filter(
+                shopping_cart__customer_id=self.request.user.id)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        if CustomPagination.uses_keyset(self.request):
+            # Cursors hold the feed ordering, not the search rank.
+            raise ValidationError(
+                {name: 'Search results are not available with cursor '
+                       'pagination.'})
+        return search_recipes(queryset, value)
+
+    def get_ordering(self, queryset, name, value):
+        return queryset.order_by(*ORDERINGS[value])
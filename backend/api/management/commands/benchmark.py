@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from api.benchmarks import BENCHMARKS
+
+BENCHMARK_SETTINGS = {
+    'ALLOWED_HOSTS': ['testserver'],
+    'CACHES': {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'benchmark',
+        }
+    },
+}
+
+
+class RollbackError(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Command 'benchmark' times hot paths on synthetic data.
+
+    Data is created in a transaction that is rolled back afterwards and
+    responses are cached in a process-local cache, so the database and
+    the shared cache are left as they were.
+    """
+
+    help = 'Runs performance benchmarks on synthetic data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*',
+            help=f'Benchmarks to run, all by default: '
+                 f'{", ".join(BENCHMARKS)}.'
+        )
+        parser.add_argument('--size', type=int, default=None,
+                            help='Size of the synthetic data set, the '
+                                 'benchmark default otherwise.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs of every timed operation.')
+
+    def handle(self, *args, **options):
+        unknown = set(options['names']) - BENCHMARKS.keys()
+        if unknown:
+            raise CommandError(f'Unknown benchmarks: {", ".join(unknown)}')
+        for name in options['names'] or BENCHMARKS:
+            function, size = BENCHMARKS[name]
+            size = options['size'] or size
+            print(f'== {name} ({size})')
+            with override_settings(**BENCHMARK_SETTINGS):
+                try:
+                    with transaction.atomic():
+                        function(size, options['repeat'])
+                        raise RollbackError
+                except RollbackError:
+                    pass
@@ -1,5 +1,196 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, PageNumberPagination,
+                                       _positive_int)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pagination on a unique ordering without OFFSET and COUNT queries.
+
+    Cursors are opaque tokens holding the ordering values of the first or
+    last object on the page. Views may set `keyset_ordering`, fields
+    prefixed with '-' are descending.
+    """
+    ordering = ('pub_date', 'id')
+    page_size = None
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+            values, reverse = cursor['v'], bool(cursor['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def to_python(self, model, values):
+        """Cursor values converted by the ordering fields of `model`."""
+        try:
+            values = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in values:
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def get_values(self, obj):
+        if isinstance(obj, dict):
+            return [obj[field.lstrip('-')] for field in self.ordering]
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def encode_cursor(self, obj, reverse):
+        values = [str(value) for value in self.get_values(obj)]
+        encoded = urlsafe_b64encode(
+            json.dumps({'v': values, 'r': int(reverse)}).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   encoded)
+
+    def position_filter(self, values, reverse):
+        position = Q()
+        names = [field.lstrip('-') for field in self.ordering]
+        for index, field in enumerate(self.ordering):
+            descending = field.startswith('-')
+            lookup = 'lt' if reverse != descending else 'gt'
+            condition = Q(**{f'{names[index]}__{lookup}': values[index]})
+            for previous, value in zip(names[:index], values):
+                condition &= Q(**{previous: value})
+            position |= condition
+        return position
+
+    def get_order_by(self, reverse):
+        if not reverse:
+            return self.ordering
+        return [field[1:] if field.startswith('-') else f'-{field}'
+                for field in self.ordering]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = getattr(view, 'keyset_ordering', self.ordering)
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        values, reverse = self.decode_cursor(request)
+        queryset = queryset.order_by(*self.get_order_by(reverse))
+        if values is not None:
+            values = self.to_python(queryset.model, values)
+            queryset = queryset.filter(self.position_filter(values, reverse))
+        return self.get_page(list(queryset[:self.page_size + 1]), values,
+                             reverse)
+
+    def get_page(self, results, values, reverse):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+        self.has_next = values is not None if reverse else has_more
+        self.has_previous = has_more if reverse else values is not None
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url,
+                                      self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class TimelinePagination(KeysetPagination):
+    """
+    Keyset pagination over several sources merged into one ordering.
+
+    Sources are (queryset, ordering) pairs of values_list querysets that
+    yield (pub_date, id) in that ordering, pages hold these tuples.
+    """
+    ordering = ('-pub_date', '-id')
+    page_size = api_settings.PAGE_SIZE
+
+    def get_values(self, obj):
+        return list(obj)
+
+    def paginate_sources(self, sources, request):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        values, reverse = self.decode_cursor(request)
+        results = set()
+        for queryset, ordering in sources:
+            source = KeysetPagination()
+            source.ordering = ordering
+            queryset = queryset.order_by(*source.get_order_by(reverse))
+            if values is not None:
+                queryset = queryset.filter(source.position_filter(
+                    source.to_python(queryset.model, values), reverse))
+            results.update(queryset[:self.page_size + 1])
+        results = sorted(results, reverse=not reverse)
+        return self.get_page(results[:self.page_size + 1], values, reverse)
 
 
 class CustomPagination(PageNumberPagination):
+    """
+    Page number pagination with opt-in keyset mode.
+
+    `?pagination=cursor` or a `cursor` parameter switches to keyset
+    pagination, which skips the count query and the OFFSET scan.
+    """
     page_size_query_param = 'limit'
+    mode_query_param = 'pagination'
+    keyset = None
+
+    @classmethod
+    def uses_keyset(cls, request):
+        return (request.query_params.get(cls.mode_query_param) == 'cursor'
+                or KeysetPagination.cursor_query_param
+                in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.uses_keyset(request):
+            self.keyset = KeysetPagination()
+            self.keyset.page_size = self.page_size
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -10,4 +10,10 @@ class AuthCheck(BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in SAFE_METHODS:
             return True
-        return obj.author == request.user or request.user.is_admin
+        return obj.author_id == request.user.id or request.user.is_admin
+
+
+class IsAdmin(BasePermission):
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and (
+            request.user.is_admin or request.user.is_superuser)
@@ -0,0 +1,62 @@
+from decimal import Decimal
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LINE_SEPARATORS = (
+    (b'\xe2\x80\xa8', b'\\u2028'),
+    (b'\xe2\x80\xa9', b'\\u2029'),
+)
+# Floats orjson writes like the stdlib encoder, which uses exponent
+# notation outside of this range and spells it differently.
+PLAIN_FLOAT_RANGE = (1e-4, 1e16)
+
+
+def encode_default(obj, default=JSONEncoder().default):
+    if isinstance(obj, Decimal):
+        value = float(obj)
+        low, high = PLAIN_FLOAT_RANGE
+        if value and not low <= abs(value) < high:
+            # orjson raises JSONEncodeError, render() falls back.
+            raise TypeError(f'{obj} needs the stdlib encoder.')
+        return value
+    return default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON renderer that encodes with orjson when it is installed.
+
+    The output matches JSONRenderer with the default compact, unicode
+    and strict settings. Indented output, other settings and setups
+    without orjson fall back to the stdlib encoder, and so does data
+    with decimals that are not finite or would be written in exponent
+    notation. Native floats are not checked, the API only outputs
+    coverage ratios.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or not self.compact
+                or self.ensure_ascii or not self.strict
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            content = orjson.dumps(
+                data, default=encode_default,
+                option=(orjson.OPT_NON_STR_KEYS
+                        | orjson.OPT_PASSTHROUGH_DATETIME)
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        for separator, escaped in LINE_SEPARATORS:
+            if separator in content:
+                content = content.replace(separator, escaped)
+        return content
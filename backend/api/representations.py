@@ -0,0 +1,218 @@
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+from django.db.models import OuterRef, Subquery
+from rest_framework.exceptions import ValidationError
+
+from recipes.models import IngredientsInRecipe, Recipe
+
+USER_FLAGS = ('is_favorited', 'is_in_shopping_cart', 'author_is_subscribed')
+CARD_FIELDS = ('id', 'name', 'image', 'cooking_time', 'author', 'tags',
+               'is_favorited', 'is_in_shopping_cart')
+SHORT_RECIPE_FIELDS = ('id', 'name', 'image', 'cooking_time')
+
+
+def get_image_url(request, name):
+    if not name:
+        return None
+    url = default_storage.url(name)
+    if request is None:
+        return url
+    return request.build_absolute_uri(url)
+
+
+def get_query_names(request, param):
+    return {
+        name.strip()
+        for value in request.query_params.getlist(param)
+        for name in value.split(',') if name.strip()
+    }
+
+
+def select_fields(request, available, default=None):
+    """
+    Output fields picked with `fields` and `omit` query parameters.
+
+    Both take comma-separated names, `fields` replaces the default set
+    and `omit` drops names from it. `id` is always kept.
+    """
+    requested = get_query_names(request, 'fields')
+    omitted = get_query_names(request, 'omit')
+    unknown = (requested | omitted) - set(available)
+    if unknown:
+        raise ValidationError({
+            'fields': [f'Unknown fields: {", ".join(sorted(unknown))}. '
+                       f'Available fields: {", ".join(available)}.']
+        })
+    selected = (requested or set(default or available)) - omitted
+    return tuple(field for field in available
+                 if field in selected or field == 'id')
+
+
+class Representation:
+    """
+    Read-only output built straight from value rows.
+
+    Stands in for a serializer in views: takes rows and `many`, exposes
+    the output as `data`. Only `fields` are output, a `get_<field>`
+    method builds a field from the row and related data, others are
+    copied from the row. Subclasses load related data for all rows at
+    once in `get_related`.
+    """
+    fields = ()
+    columns = {}
+    key_columns = ('id',)
+
+    def __init__(self, instance, many=False, context=None, fields=None):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+        if fields is not None:
+            self.fields = fields
+
+    @classmethod
+    def get_columns(cls, fields):
+        """Row columns needed to output `fields`."""
+        columns = dict.fromkeys(cls.key_columns)
+        for field in fields:
+            columns.update(dict.fromkeys(cls.columns.get(field, (field,))))
+        return tuple(columns)
+
+    @property
+    def data(self):
+        rows = list(self.instance) if self.many else [self.instance]
+        related = self.get_related(rows)
+        getters = [(field, getattr(self, f'get_{field}', None))
+                   for field in self.fields]
+        data = [
+            {
+                field: row[field] if getter is None else getter(row, related)
+                for field, getter in getters
+            }
+            for row in rows
+        ]
+        return data if self.many else data[0]
+
+    def get_related(self, rows):
+        return None
+
+
+class RecipeRepresentation(Representation):
+    """
+    Same output as RecipeSerializer for rows of `get_columns(fields)`.
+
+    Pub date and counters are always loaded for keyset cursors, tags and
+    ingredients are only loaded when requested.
+    """
+    fields = ('id', 'name', 'text', 'cooking_time', 'image',
+              'image_variants', 'author', 'ingredients', 'tags',
+              'is_favorited', 'is_in_shopping_cart')
+    columns = {
+        'author': ('author_id', 'author__email', 'author__username',
+                   'author__first_name', 'author__last_name',
+                   'author_is_subscribed'),
+        'ingredients': (),
+        'tags': (),
+    }
+    key_columns = ('id', 'pub_date', 'favorites_count', 'in_carts_count')
+
+    def get_related(self, rows):
+        recipe_ids = [row['id'] for row in rows]
+        tags = defaultdict(list)
+        if 'tags' in self.fields:
+            for recipe_id, tag_id, name, color, slug in (
+                    Recipe.tags.through.objects.filter(
+                        recipe_id__in=recipe_ids
+                    ).order_by('tag__name').values_list(
+                        'recipe_id', 'tag_id', 'tag__name', 'tag__color',
+                        'tag__slug')):
+                tags[recipe_id].append(
+                    {'id': tag_id, 'name': name, 'color': color,
+                     'slug': slug})
+        ingredients = defaultdict(list)
+        if 'ingredients' in self.fields:
+            for recipe_id, ingredient_id, name, measurement_unit, amount in (
+                    IngredientsInRecipe.objects.filter(
+                        recipe_id__in=recipe_ids
+                    ).order_by('id').values_list(
+                        'recipe_id', 'ingredients_id', 'ingredients__name',
+                        'ingredients__measurement_unit', 'amount')):
+                ingredients[recipe_id].append({
+                    'id': ingredient_id,
+                    'name': name,
+                    'measurement_unit': measurement_unit,
+                    'amount': amount,
+                })
+        return tags, ingredients
+
+    def get_image(self, row, related):
+        return get_image_url(self.context.get('request'), row['image'])
+
+    def get_image_variants(self, row, related):
+        request = self.context.get('request')
+        return {
+            name: {
+                extension: get_image_url(request, path)
+                for extension, path in formats.items()
+            }
+            for name, formats in row['image_variants'].items()
+        }
+
+    def get_author(self, row, related):
+        return {
+            'email': row['author__email'],
+            'id': row['author_id'],
+            'username': row['author__username'],
+            'first_name': row['author__first_name'],
+            'last_name': row['author__last_name'],
+            'is_subscribed': row['author_is_subscribed'],
+        }
+
+    def get_ingredients(self, row, related):
+        return related[1][row['id']]
+
+    def get_tags(self, row, related):
+        return related[0][row['id']]
+
+
+class SubscriptionRepresentation(Representation):
+    """
+    Same output as ShowSubscriptionsSerializer for author rows.
+
+    `recipes_limit` query parameter limits recipes of every author,
+    they are only loaded when requested. Username is always loaded for
+    keyset cursors.
+    """
+    fields = ('id', 'email', 'username', 'first_name', 'last_name',
+              'is_subscribed', 'recipes', 'recipes_count')
+    columns = {'is_subscribed': (), 'recipes': ()}
+    key_columns = ('id', 'username')
+
+    def get_related(self, rows):
+        by_author = defaultdict(list)
+        if 'recipes' not in self.fields:
+            return by_author
+        request = self.context.get('request')
+        recipes = Recipe.objects.filter(
+            author_id__in=[row['id'] for row in rows])
+        recipes_limit = request.query_params.get('recipes_limit')
+        if recipes_limit:
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('id')[:int(recipes_limit)]
+            ))
+        for recipe in recipes.values('author_id', *SHORT_RECIPE_FIELDS):
+            by_author[recipe['author_id']].append({
+                'id': recipe['id'],
+                'name': recipe['name'],
+                'image': get_image_url(request, recipe['image']),
+                'cooking_time': recipe['cooking_time'],
+            })
+        return by_author
+
+    def get_is_subscribed(self, row, related):
+        return True
+
+    def get_recipes(self, row, related):
+        return related[row['id']]
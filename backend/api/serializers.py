@@ -1,10 +1,17 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework import serializers
 
-from recipes.models import (Favorite, Ingredient, IngredientsInRecipe, Recipe,
-                            ShoppingCart, Tag)
+from recipes import shopping_list, timeline
+from recipes.matching import update_recipe_matches
+from recipes.models import (IMAGE_PENDING, Favorite, Ingredient,
+                            IngredientsInRecipe, Recipe, ShoppingCart, Tag)
+from recipes.search import update_search_vectors
 from users.models import Subscription, User
 from users.serializers import CustomUserSerializer
 
+from .cache import invalidate_recipe_feed
 from .fields import Base64ImageField
 
 
@@ -66,25 +73,47 @@ class RecipeSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    image_variants = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'text', 'cooking_time', 'image', 'author',
-                  'ingredients', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('id', 'name', 'text', 'cooking_time', 'image',
+                  'image_variants', 'author', 'ingredients', 'tags',
+                  'is_favorited', 'is_in_shopping_cart')
+
+    def to_representation(self, obj):
+        if hasattr(obj, 'author_is_subscribed'):
+            obj.author.is_subscribed = obj.author_is_subscribed
+        return super().to_representation(obj)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
         return Favorite.objects.filter(
-            owner=request.user, favorite__id=obj.id).exists()
+            owner_id=request.user.id, favorite_id=obj.id).exists()
+
+    def get_image_variants(self, obj):
+        request = self.context.get('request')
+        return {
+            name: {
+                extension: request.build_absolute_uri(
+                    default_storage.url(path))
+                for extension, path in formats.items()
+            }
+            for name, formats in obj.image_variants.items()
+        }
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
         return ShoppingCart.objects.filter(
-            customer=request.user, purchase__id=obj.id).exists()
+            customer_id=request.user.id, purchase_id=obj.id).exists()
 
 
 class RecipeSerializerCreate(serializers.ModelSerializer):
@@ -102,11 +131,11 @@ class RecipeSerializerCreate(serializers.ModelSerializer):
 
     def validate(self, data):
         ingredients_list = []
-        for ingredient in data['ingredients']:
+        for ingredient in data.get('ingredients', ()):
             if ingredient['id'].id in ingredients_list:
                 raise serializers.ValidationError('Duplicated ingredients')
             ingredients_list.append(ingredient['id'].id)
-        if data['cooking_time'] == 0:
+        if data.get('cooking_time') == 0:
             raise serializers.ValidationError(
                 'Cooking time should be more than 0'
             )
@@ -123,17 +152,85 @@ class RecipeSerializerCreate(serializers.ModelSerializer):
                      for ingredient in ingredients]
         IngredientsInRecipe.objects.bulk_create(temp_data)
         recipe.tags.set(tags)
+        update_search_vectors([recipe.id])
+        invalidate_recipe_feed()
+        update_recipe_matches(recipe.id, [ingredient['id'].id
+                                          for ingredient in ingredients])
+        transaction.on_commit(lambda: timeline.push_recipe(recipe))
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """
+        Brings ingredient rows of the recipe in line with `ingredients`.
+
+        Only changed amounts, new and removed rows are written. Returns
+        old and new amounts as {ingredient_id: amount}.
+        """
+        rows = {
+            row.ingredients_id: row
+            for row in IngredientsInRecipe.objects.filter(recipe=recipe)
+        }
+        old_amounts = {
+            ingredient_id: row.amount for ingredient_id, row in rows.items()
+        }
+        new_amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            row = rows.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        IngredientsInRecipe.objects.bulk_update(changed, ('amount',))
+        IngredientsInRecipe.objects.bulk_create([
+            IngredientsInRecipe(recipe=recipe, ingredients_id=ingredient_id,
+                                amount=amount)
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in rows
+        ])
+        removed = [row.id for ingredient_id, row in rows.items()
+                   if ingredient_id not in new_amounts]
+        if removed:
+            IngredientsInRecipe.objects.filter(id__in=removed).delete()
+        return old_amounts, new_amounts
+
+    def update_tags(self, recipe, tags):
+        recipe_tags = Recipe.tags.through.objects
+        current = set(recipe_tags.filter(recipe=recipe).values_list(
+            'tag_id', flat=True))
+        new = {tag.id for tag in tags}
+        if current - new:
+            recipe_tags.filter(recipe=recipe,
+                               tag_id__in=current - new).delete()
+        recipe_tags.bulk_create([
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag_id)
+            for tag_id in new - current
+        ])
+
+    @transaction.atomic
     def update(self, obj, validated_data):
-        ingredients = validated_data.pop('ingredients')
-        IngredientsInRecipe.objects.filter(recipe=obj).delete()
-        temp_data = [IngredientsInRecipe(recipe=obj,
-                                         amount=ingredient['amount'],
-                                         ingredients=ingredient['id'])
-                     for ingredient in ingredients]
-        IngredientsInRecipe.objects.bulk_create(temp_data)
-        return super().update(obj, validated_data)
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if 'image' in validated_data:
+            validated_data['image_status'] = IMAGE_PENDING
+        search_changed = 'name' in validated_data or 'text' in validated_data
+        if ingredients is not None:
+            old_amounts, new_amounts = self.update_ingredients(
+                obj, ingredients)
+            if old_amounts != new_amounts:
+                shopping_list.update_recipe(obj, old_amounts, new_amounts)
+            if old_amounts.keys() != new_amounts.keys():
+                update_recipe_matches(obj.id, new_amounts)
+                search_changed = True
+        if tags is not None:
+            self.update_tags(obj, tags)
+        invalidate_recipe_feed()
+        recipe = super().update(obj, validated_data)
+        if search_changed:
+            update_search_vectors([recipe.id])
+        return recipe
 
     def to_representation(self, obj):
         return RecipeSerializer(
@@ -148,6 +245,14 @@ class ShowRecipesSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
 
 
+class MatchedRecipeSerializer(ShowRecipesSerializer):
+    coverage = serializers.FloatField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(ShowRecipesSerializer.Meta):
+        fields = ShowRecipesSerializer.Meta.fields + ('coverage', 'missing')
+
+
 class ShowSubscriptionsSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
     recipes = serializers.SerializerMethodField(read_only=True)
@@ -159,9 +264,11 @@ class ShowSubscriptionsSerializer(serializers.ModelSerializer):
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return Subscription.objects.filter(
-            subscriber=self.context.get('request').user,
-            subscription=obj
+            subscriber_id=self.context.get('request').user.id,
+            subscription_id=obj.id
         ).exists()
 
     def get_recipes(self, obj):
@@ -174,68 +281,14 @@ class ShowSubscriptionsSerializer(serializers.ModelSerializer):
             recipes, many=True, context={'request': request}).data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return Recipe.objects.filter(author=obj).count()
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Subscription
-        fields = ('subscriber', 'subscription')
-
-    def validate(self, data):
-        if Subscription.objects.filter(
-            subscriber=self.context['request'].user,
-            subscription=data['subscription']
-        ).exists():
-            raise serializers.ValidationError('Already subscribed.')
-        if self.context['request'].user == data['subscription']:
-            raise serializers.ValidationError("Can't subscribe to yourself.")
-        return data
-
-    def to_representation(self, obj):
-        return ShowSubscriptionsSerializer(
-            obj.subscription,
-            context={'request': self.context.get('request')}).data
-
-
-class FavoriteSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Favorite
-        fields = ('owner', 'favorite')
-
-    def validate(self, data):
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
-            return False
-        if Favorite.objects.filter(owner=request.user,
-                                   favorite=data['favorite']).exists():
-            raise serializers.ValidationError('Already in favorites.')
-        return data
-
-    def to_representation(self, obj):
-        request = self.context.get('request')
-        return ShowRecipesSerializer(obj.favorite,
-                                     context={'request': request}).data
-
-
-class ShoppingCartSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = ShoppingCart
-        fields = ('customer', 'purchase')
-
-    def validate(self, data):
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
-            return False
-        if ShoppingCart.objects.filter(customer=request.user,
-                                       purchase=data['purchase']).exists():
-            raise serializers.ValidationError('Already in shopping list.')
-        return data
-
-    def to_representation(self, obj):
-        request = self.context.get('request')
-        return ShowRecipesSerializer(obj.purchase,
-                                     context={'request': request}).data
+class BatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_SIZE
+    )
@@ -0,0 +1,49 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+from .authentication import invalidate_token, invalidate_user_tokens
+from .cache import invalidate_recipe_feed, invalidate_reference
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_reference('tags'))
+    invalidate_recipe_feed()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_reference('ingredients'))
+    invalidate_recipe_feed()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipes(sender, **kwargs):
+    invalidate_recipe_feed()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_user_tokens(instance.id)
+
+
+@receiver(user_logged_out)
+def invalidate_logged_out_token(sender, request, **kwargs):
+    token = getattr(request, 'auth', None)
+    if isinstance(token, Token):
+        invalidate_token(token.key)
@@ -0,0 +1,1093 @@
+import io
+import json
+import os
+import re
+import tempfile
+from base64 import b64encode
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models.deletion import Collector
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from recipes import timeline
+from recipes.management.commands.importrecipes import id_maps, import_chunk
+from recipes.matching import build_match_index, ingredient_match_index
+from recipes.models import (Favorite, Ingredient, IngredientsInRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag, TimelineEntry)
+from recipes.search import recipe_search_index, uses_search_vector
+from users.models import Subscription, User
+
+from .authentication import (TOKEN_KEY, CachedTokenAuthentication, get_digest,
+                             local_tokens)
+from .checks import check_shared_cache
+from .fields import Base64ImageField
+from .renderers import FastJSONRenderer
+from .serializers import RecipeSerializer
+from .views import get_recipe_queryset
+
+FAKE_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api-tests',
+    }
+}
+
+
+class RecipeDataMixin:
+    """Authors with recipes of varying tags and ingredients."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.org', password='pass',
+            first_name='Reader', last_name='User')
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.org', password='pass',
+                first_name='Author', last_name=str(number))
+            for number in range(3)
+        ]
+        cls.tags = [
+            Tag.objects.create(name=f'Tag {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ingredient {number}',
+                                      measurement_unit='g')
+            for number in range(12)
+        ]
+        cls.recipes = []
+        for number in range(12):
+            recipe = Recipe.objects.create(
+                name=f'Recipe {number}', text='Text', cooking_time=10,
+                image='recipes/images/recipe.png',
+                author=cls.authors[number % 3])
+            recipe.tags.set(cls.tags[:number % 3 + 1])
+            IngredientsInRecipe.objects.bulk_create(
+                IngredientsInRecipe(recipe=recipe,
+                                    ingredients=cls.ingredients[index],
+                                    amount=index + 1)
+                for index in range(number % 4 + 1)
+            )
+            cls.recipes.append(recipe)
+        for author in cls.authors[:2]:
+            Subscription.objects.create(subscriber=cls.user,
+                                        subscription=author)
+        Recipe.objects.filter(id=cls.recipes[2].id).update(
+            image='', image_variants={
+                'small': {'webp': 'recipes/variants/recipe_small.webp'}})
+        Favorite.objects.create(owner=cls.user, favorite=cls.recipes[0])
+        ShoppingCart.objects.create(customer=cls.user,
+                                    purchase=cls.recipes[1])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class QueryCountTest(RecipeDataMixin, APITestCase):
+    """Read endpoints run a fixed number of queries whatever the page size."""
+
+    def assert_queries(self, url, queries):
+        for limit in (1, 5, 12):
+            with self.subTest(url=url, limit=limit):
+                cache.clear()
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url, {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+
+    def test_recipe_list(self):
+        self.assert_queries('/api/recipes/', 7)
+
+    def test_recipe_detail(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/recipes/{self.recipes[0].id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_subscriptions(self):
+        self.assert_queries('/api/users/subscriptions/', 3)
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class SparseFieldsQueryTest(RecipeDataMixin, APITestCase):
+    """Fields left out with `fields` and `omit` are not queried."""
+
+    def assert_queries(self, url, params, queries, skipped):
+        cache.clear()
+        with self.assertNumQueries(queries) as captured:
+            response = self.client.get(url, {'limit': 5, **params})
+        self.assertEqual(response.status_code, 200)
+        sql = ' '.join(query['sql'] for query in captured.captured_queries)
+        for table in skipped:
+            self.assertNotIn(table, sql)
+        return response.json()['results']
+
+    def test_recipe_list(self):
+        self.assert_queries('/api/recipes/', {}, 7, ())
+        ingredients = ('"recipes_ingredientsinrecipe"',)
+        tags = ('"recipes_recipe_tags"',)
+        flags = ('"recipes_favorite"', '"recipes_shoppingcart"',
+                 '"users_subscription"')
+        for params, queries, skipped in (
+                ({'fields': 'id,name'}, 2, ingredients + tags + flags),
+                ({'omit': 'ingredients,tags,is_favorited,'
+                          'is_in_shopping_cart,author'}, 2,
+                 ingredients + tags + flags),
+                ({'omit': 'ingredients'}, 6, ingredients),
+                ({'omit': 'tags'}, 6, tags),
+                ({'representation': 'card'}, 6, ingredients)):
+            with self.subTest(params=params):
+                results = self.assert_queries('/api/recipes/', params,
+                                              queries, skipped)
+                self.assertEqual(len(results), 5)
+
+    def test_subscriptions(self):
+        results = self.assert_queries(
+            '/api/users/subscriptions/', {'omit': 'recipes,recipes_count'},
+            2, {'"recipes_recipe"'})
+        self.assertEqual(set(results[0]), {
+            'id', 'email', 'username', 'first_name', 'last_name',
+            'is_subscribed'})
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class RepresentationContractTest(RecipeDataMixin, APITestCase):
+    """Recipes built from value rows match RecipeSerializer output."""
+
+    def serialize(self, user, queryset, many=False):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        data = RecipeSerializer(queryset, many=many,
+                                context={'request': request}).data
+        return json.loads(JSONRenderer().render(data))
+
+    def assert_same(self, data, expected):
+        # Compared as JSON text, so the order of keys matters too.
+        self.assertEqual(json.dumps(data), json.dumps(expected))
+
+    def assert_list_matches(self, user):
+        expected = self.serialize(
+            user, get_recipe_queryset(user).order_by('pub_date', 'id'),
+            many=True)
+        for attempt in ('cache miss', 'cache hit'):
+            with self.subTest(attempt=attempt):
+                response = self.client.get('/api/recipes/', {'limit': 100})
+                self.assert_same(response.json()['results'], expected)
+
+    def assert_detail_matches(self, user):
+        for recipe in self.recipes[:3]:
+            with self.subTest(recipe=recipe.id):
+                response = self.client.get(f'/api/recipes/{recipe.id}/')
+                self.assert_same(response.json(), self.serialize(
+                    user, get_recipe_queryset(user).get(id=recipe.id)))
+
+    def test_list_authenticated(self):
+        self.assert_list_matches(self.user)
+
+    def test_list_anonymous(self):
+        self.client.force_authenticate(None)
+        self.assert_list_matches(AnonymousUser())
+
+    def test_detail_authenticated(self):
+        self.assert_detail_matches(self.user)
+
+    def test_detail_anonymous(self):
+        self.client.force_authenticate(None)
+        self.assert_detail_matches(AnonymousUser())
+
+    def test_user_flags(self):
+        response = self.client.get('/api/recipes/', {'limit': 100})
+        recipes = {recipe['id']: recipe for recipe in response.json()[
+            'results']}
+        self.assertTrue(recipes[self.recipes[0].id]['is_favorited'])
+        self.assertTrue(recipes[self.recipes[1].id]['is_in_shopping_cart'])
+        self.assertTrue(
+            recipes[self.recipes[0].id]['author']['is_subscribed'])
+        self.assertFalse(
+            recipes[self.recipes[2].id]['author']['is_subscribed'])
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class FastJSONRendererTest(RecipeDataMixin, APITestCase):
+    """orjson output is byte for byte what JSONRenderer writes."""
+
+    def get_page(self):
+        Recipe.objects.filter(id=self.recipes[0].id).update(
+            name='Борщ «домашний» 🍲', text='Свёкла\u2028соль\u2029вода')
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = self.user
+        results = RecipeSerializer(
+            get_recipe_queryset(self.user).order_by('pub_date', 'id'),
+            many=True, context={'request': request}).data
+        return {'count': len(results), 'next': None, 'previous': None,
+                'results': results}
+
+    def assert_same(self, data):
+        self.assertEqual(FastJSONRenderer().render(data),
+                         JSONRenderer().render(data))
+
+    def test_recipe_page(self):
+        page = self.get_page()
+        self.assertIn(b'\\u2028', JSONRenderer().render(page))
+        self.assert_same(page)
+
+    def test_decimals(self):
+        page = self.get_page()
+        for value in ('0', '2.50', '-3.3', '0.0001', '0.00001',
+                      '123456789.123', '1e16', '1.5e-7'):
+            with self.subTest(value=value):
+                page['results'][0]['price'] = Decimal(value)
+                self.assert_same(page)
+        page['results'][0]['price'] = Decimal('NaN')
+        with self.assertRaises(ValueError):
+            FastJSONRenderer().render(page)
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class RecipeUpdateTest(RecipeDataMixin, APITestCase):
+    """PATCH writes only the ingredient and tag rows that changed."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[3]
+        self.client.force_authenticate(self.recipe.author)
+        self.rows = dict(IngredientsInRecipe.objects.filter(
+            recipe=self.recipe).values_list('ingredients_id', 'id'))
+
+    def patch(self, data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(f'/api/recipes/{self.recipe.id}/',
+                                         data, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return context.captured_queries
+
+    def writes(self, queries, model):
+        table = f'"{model._meta.db_table}"'
+        return Counter(
+            query['sql'].split()[0] for query in queries
+            if table in query['sql'].split('WHERE')[0]
+            and not query['sql'].startswith('SELECT')
+        )
+
+    def ingredient_payload(self, amounts):
+        return [{'id': ingredient_id, 'amount': amount}
+                for ingredient_id, amount in amounts.items()]
+
+    def current_amounts(self):
+        return dict(IngredientsInRecipe.objects.filter(
+            recipe=self.recipe).values_list('ingredients_id', 'amount'))
+
+    def test_unchanged_ingredients_and_tags(self):
+        queries = self.patch({
+            'ingredients': self.ingredient_payload(self.current_amounts()),
+            'tags': [tag.id for tag in self.recipe.tags.all()],
+        })
+        self.assertEqual(self.writes(queries, IngredientsInRecipe), {})
+        self.assertEqual(self.writes(queries, Recipe.tags.through), {})
+        self.assertEqual(dict(IngredientsInRecipe.objects.filter(
+            recipe=self.recipe).values_list('ingredients_id', 'id')),
+            self.rows)
+
+    def test_title_only(self):
+        queries = self.patch({'name': 'Renamed'})
+        self.assertEqual(self.writes(queries, IngredientsInRecipe), {})
+        self.assertEqual(self.writes(queries, Recipe.tags.through), {})
+        self.assertEqual(self.writes(queries, Recipe), {'UPDATE': 1})
+
+    def test_ingredient_diff(self):
+        amounts = self.current_amounts()
+        changed, removed, *kept = amounts
+        amounts[changed] += 5
+        del amounts[removed]
+        added = self.ingredients[-1].id
+        amounts[added] = 7
+        queries = self.patch(
+            {'ingredients': self.ingredient_payload(amounts)})
+        self.assertEqual(self.writes(queries, IngredientsInRecipe),
+                         {'UPDATE': 1, 'INSERT': 1, 'DELETE': 1})
+        self.assertEqual(self.current_amounts(), amounts)
+        rows = dict(IngredientsInRecipe.objects.filter(
+            recipe=self.recipe).values_list('ingredients_id', 'id'))
+        for ingredient_id in [changed, *kept]:
+            self.assertEqual(rows[ingredient_id], self.rows[ingredient_id])
+
+    def test_tag_diff(self):
+        queries = self.patch({'tags': [self.tags[1].id]})
+        self.assertEqual(self.writes(queries, Recipe.tags.through),
+                         {'INSERT': 1, 'DELETE': 1})
+        self.assertEqual(list(self.recipe.tags.all()), [self.tags[1]])
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class ReferenceCacheTest(APITestCase):
+    """Tag and ingredient responses are cached and revalidated."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Breakfast', color='#ff0000',
+                                     slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(name='Salt',
+                                                   measurement_unit='g')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_response(self):
+        first = self.client.get('/api/tags/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/tags/')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertIn('Last-Modified', second)
+
+    def test_not_modified(self):
+        etag = self.client.get('/api/ingredients/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/ingredients/',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_invalidated_on_save(self):
+        response = self.client.get('/api/tags/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.filter(id=self.tag.id).first().save()
+            Tag.objects.create(name='Dinner', color='#00ff00',
+                               slug='dinner')
+        changed = self.client.get('/api/tags/',
+                                  HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual([tag['slug'] for tag in changed.json()],
+                         ['breakfast', 'dinner'])
+
+    def test_invalidated_on_delete(self):
+        self.client.get(f'/api/ingredients/{self.ingredient.id}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.filter(id=self.ingredient.id).delete()
+        response = self.client.get(f'/api/ingredients/{self.ingredient.id}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalidated_after_commit(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks() as callbacks:
+            Tag.objects.create(name='Dinner', color='#00ff00',
+                               slug='dinner')
+            # Readers in other transactions must not cache the old rows
+            # under a new version before the change is committed.
+            response = self.client.get('/api/tags/',
+                                       HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        for callback in callbacks:
+            callback()
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_scopes_are_separate(self):
+        tags_etag = self.client.get('/api/tags/')['ETag']
+        Ingredient.objects.create(name='Pepper', measurement_unit='g')
+        response = self.client.get('/api/tags/',
+                                   HTTP_IF_NONE_MATCH=tags_etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_local_cache_warning(self):
+        self.assertEqual(
+            [warning.id for warning in check_shared_cache(None)],
+            ['api.W001'])
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class PopularOrderingCacheTest(RecipeDataMixin, APITestCase):
+    """Cached pages ordered by popularity follow counter changes."""
+
+    def get_page(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self):
+        ids = []
+        page = self.get_page('/api/recipes/',
+                             {'ordering': '-popular', 'limit': 5})
+        while True:
+            ids += [recipe['id'] for recipe in page['results']]
+            if not page['next']:
+                return ids
+            page = self.get_page(page['next'])
+
+    def expected(self):
+        return list(Recipe.objects.order_by(
+            '-favorites_count', '-in_carts_count', '-id'
+        ).values_list('id', flat=True))
+
+    def assert_walk(self):
+        ids = self.walk()
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(ids, self.expected())
+
+    def toggle(self, method, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, data,
+                                                    format='json')
+        self.assertLess(response.status_code, 300, response.content)
+
+    def test_favorite_not_skipped(self):
+        self.assert_walk()
+        self.toggle('post', f'/api/recipes/{self.recipes[5].id}/favorite/')
+        self.assertEqual(self.walk()[0], self.recipes[5].id)
+        self.assert_walk()
+
+    def test_favorite_batch_not_skipped(self):
+        self.assert_walk()
+        self.toggle('post', '/api/recipes/favorite/batch/',
+                    {'ids': [self.recipes[3].id, self.recipes[4].id]})
+        self.assert_walk()
+
+    def test_shopping_cart_not_duplicated(self):
+        Recipe.objects.filter(id=self.recipes[1].id).update(in_carts_count=1)
+        self.assert_walk()
+        self.toggle('delete',
+                    f'/api/recipes/{self.recipes[1].id}/shopping_cart/')
+        self.assert_walk()
+
+    def test_shopping_cart_batch_not_duplicated(self):
+        Recipe.objects.filter(id=self.recipes[1].id).update(in_carts_count=1)
+        self.assert_walk()
+        self.toggle('delete', '/api/recipes/shopping_cart/batch/',
+                    {'ids': [self.recipes[1].id]})
+        self.assert_walk()
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class BatchReplayTest(RecipeDataMixin, APITestCase):
+    """Replayed batches don't apply their side effects twice."""
+
+    def send(self, method, url, ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, {'ids': ids},
+                                                    format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [result['status'] for result in response.json()['results']]
+
+    def get_state(self):
+        return (
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', 'in_carts_count')),
+            dict(ShoppingListItem.objects.filter(user=self.user)
+                 .values_list('ingredient_id', 'total_amount')),
+        )
+
+    def test_replay(self):
+        ids = [self.recipes[3].id, self.recipes[4].id]
+        for url, links in (
+            ('/api/recipes/favorite/batch/', self.user.owner),
+            ('/api/recipes/shopping_cart/batch/', self.user.customer),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.send('post', url, ids),
+                                 ['created', 'created'])
+                added = self.get_state()
+                self.assertEqual(self.send('post', url, ids),
+                                 ['already_exists', 'already_exists'])
+                self.assertEqual(self.get_state(), added)
+                self.assertEqual(self.send('delete', url, ids),
+                                 ['deleted', 'deleted'])
+                removed = self.get_state()
+                self.assertEqual(self.send('delete', url, ids),
+                                 ['not_found', 'not_found'])
+                self.assertEqual(self.get_state(), removed)
+                self.assertEqual(links.count(), 1)
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class TagFilterTest(RecipeDataMixin, APITestCase):
+    """Recipes filtered by any or all of several tags."""
+
+    def get_ids(self, slugs, mode=None):
+        params = {'tags': slugs, 'limit': 100}
+        if mode is not None:
+            params['tags_mode'] = mode
+        response = self.client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def expected(self, remainders):
+        return [recipe.id for number, recipe in enumerate(self.recipes)
+                if number % 3 in remainders]
+
+    def test_modes(self):
+        for slugs, mode, remainders in (
+                (['tag1', 'tag2'], None, (1, 2)),
+                (['tag1', 'tag2'], 'any', (1, 2)),
+                (['tag1', 'tag2'], 'all', (2,)),
+                (['tag0', 'tag1', 'tag1'], 'all', (1, 2)),
+                (['tag2', 'unknown'], 'any', (2,)),
+                (['tag2', 'unknown'], 'all', ()),
+                (['unknown'], 'any', ())):
+            with self.subTest(slugs=slugs, mode=mode):
+                ids = self.get_ids(slugs, mode)
+                self.assertEqual(len(ids), len(set(ids)))
+                self.assertEqual(ids, self.expected(remainders))
+
+
+@override_settings(CACHES=FAKE_CACHES, TIMELINE_MAX_SIZE=3,
+                   TIMELINE_FANOUT_LIMIT=2)
+class TimelineTest(APITestCase):
+    """Feeds merge pushed entries with recipes of popular authors."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.other, cls.late, cls.author, cls.popular = [
+            User.objects.create_user(
+                username=name, email=f'{name}@example.org', password='pass')
+            for name in ('reader', 'other', 'late', 'author', 'popular')
+        ]
+        Subscription.objects.bulk_create([
+            Subscription(subscriber=cls.reader, subscription=cls.author),
+            Subscription(subscriber=cls.other, subscription=cls.author),
+            Subscription(subscriber=cls.reader, subscription=cls.popular),
+            Subscription(subscriber=cls.other, subscription=cls.popular),
+            Subscription(subscriber=cls.late, subscription=cls.popular),
+        ])
+
+    def setUp(self):
+        self.published = timezone.now()
+
+    def publish(self, author):
+        recipe = Recipe.objects.create(
+            name='Recipe', text='Text', cooking_time=10,
+            image='recipes/images/recipe.png', author=author)
+        self.published += timedelta(minutes=1)
+        Recipe.objects.filter(id=recipe.id).update(pub_date=self.published)
+        recipe.refresh_from_db()
+        timeline.push_recipe(recipe)
+        return recipe.id
+
+    def get_feed(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/recipes/feed/', {'limit': 10})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def get_entries(self, user):
+        return list(TimelineEntry.objects.filter(user=user).order_by(
+            '-pub_date').values_list('recipe_id', flat=True))
+
+    def test_feed_order(self):
+        recipe_ids = [self.publish(author) for author in (
+            self.author, self.popular, self.author, self.popular)]
+        self.assertEqual(self.get_entries(self.reader), recipe_ids[2::-2])
+        self.assertEqual(self.get_feed(self.reader), recipe_ids[::-1])
+
+    def test_trimmed(self):
+        recipe_ids = [self.publish(self.author) for _ in range(5)]
+        for user in (self.reader, self.other):
+            self.assertEqual(self.get_entries(user), recipe_ids[:1:-1])
+        self.assertEqual(self.get_feed(self.reader), recipe_ids[:1:-1])
+        self.assertEqual(timeline.trim([self.reader.id, self.late.id]), 0)
+
+    def test_backfill(self):
+        recipe_ids = [self.publish(self.author) for _ in range(5)]
+        self.client.force_authenticate(self.late)
+        response = self.client.post(
+            f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_entries(self.late), recipe_ids[:1:-1])
+        self.assertEqual(self.get_feed(self.late), recipe_ids[:1:-1])
+
+    def test_unsubscribe(self):
+        recipe_ids = [self.publish(author) for author in (
+            self.author, self.popular, self.author)]
+        self.client.force_authenticate(self.reader)
+        response = self.client.delete(
+            f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_entries(self.reader), [])
+        self.assertEqual(self.get_entries(self.other), recipe_ids[::-2])
+        self.assertEqual(self.get_feed(self.reader), [recipe_ids[1]])
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class KeysetPaginationTest(RecipeDataMixin, APITestCase):
+    """Cursors walk the feed both ways and reject forged values."""
+
+    def get_page(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get_ids(self, page):
+        return [recipe['id'] for recipe in page['results']]
+
+    def assert_round_trip(self, params, expected):
+        pages = [self.get_page('/api/recipes/', params)]
+        while pages[-1]['next']:
+            pages.append(self.get_page(pages[-1]['next']))
+        self.assertIsNone(pages[0]['previous'])
+        self.assertEqual(
+            [recipe_id for page in pages for recipe_id in self.get_ids(page)],
+            expected)
+        for page, previous in zip(pages[:0:-1], pages[-2::-1]):
+            self.assertEqual(self.get_ids(self.get_page(page['previous'])),
+                             self.get_ids(previous))
+
+    def test_round_trip(self):
+        self.assert_round_trip(
+            {'pagination': 'cursor', 'limit': 5},
+            list(Recipe.objects.order_by('pub_date', 'id')
+                 .values_list('id', flat=True)))
+
+    def test_descending_round_trip(self):
+        for number, recipe in enumerate(self.recipes):
+            Recipe.objects.filter(id=recipe.id).update(
+                favorites_count=number % 3, in_carts_count=number % 2)
+        self.assert_round_trip(
+            {'pagination': 'cursor', 'ordering': '-popular', 'limit': 4},
+            list(Recipe.objects.order_by(
+                '-favorites_count', '-in_carts_count', '-id'
+            ).values_list('id', flat=True)))
+
+    def test_forged_cursor(self):
+        cursors = [
+            'not base64!',
+            b64encode(b'not json').decode(),
+            b64encode(b'[]').decode(),
+            b64encode(b'{"v": ["1"], "r": 0}').decode(),
+            b64encode(b'{"v": "ab", "r": 0}').decode(),
+            b64encode(b'{"v": ["yesterday", "1"], "r": 0}').decode(),
+            b64encode(b'{"v": [null, "1"], "r": 0}').decode(),
+            b64encode(b'{"v": ["2022-01-01T00:00:00", "x"], "r": 0}')
+            .decode(),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/api/recipes/',
+                                           {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class QueryPlanTest(RecipeDataMixin, APITestCase):
+    """
+    API queries are served by indexes, not full table scans.
+
+    Every statement run by the requests is explained. On PostgreSQL
+    sequential scans are disabled first, so a plan keeps one only when
+    no index can serve the query.
+    """
+    skipped = ('SAVEPOINT', 'RELEASE', 'ROLLBACK')
+
+    def get_full_scans(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET enable_seqscan = off')
+                try:
+                    cursor.execute(f'EXPLAIN {sql}')
+                    plan = [row[0] for row in cursor.fetchall()]
+                finally:
+                    cursor.execute('RESET enable_seqscan')
+                return [match for line in plan
+                        for match in re.findall(r'Seq Scan on (\w+)', line)]
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        tables = set(connection.introspection.table_names())
+        aliases = dict(
+            (alias, table)
+            for table, alias in re.findall(r'"(\w+)" (\w+)', sql)
+            if table in tables
+        )
+        scans = []
+        for line in plan:
+            match = re.fullmatch(r'SCAN (\w+)', line)
+            if match:
+                name = aliases.get(match[1], match[1])
+                if name in tables:
+                    scans.append(name)
+        return scans
+
+    def assert_index_scans(self, method, url, data=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data,
+                                                    format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 300, url)
+        for query in context.captured_queries:
+            if query['sql'].startswith(self.skipped):
+                continue
+            with self.subTest(url=url, sql=query['sql']):
+                self.assertEqual(self.get_full_scans(query['sql']), [])
+
+    def test_full_scan_detected(self):
+        queryset = Recipe.objects.filter(cooking_time=10).order_by()
+        sql = str(queryset.values('id').query)
+        self.assertEqual(self.get_full_scans(sql), ['recipes_recipe'])
+
+    def test_reads(self):
+        recipe = self.recipes[0]
+        for url in (
+            '/api/recipes/?limit=6',
+            f'/api/recipes/{recipe.id}/',
+            f'/api/recipes/?author={self.authors[1].id}',
+            '/api/recipes/?tags=tag1&tags=tag2',
+            '/api/recipes/?is_favorited=1',
+            '/api/recipes/?is_in_shopping_cart=1',
+            '/api/recipes/?ordering=-popular',
+            f'/api/recipes/matching/?ingredients={self.ingredients[0].id}',
+            '/api/recipes/feed/',
+            '/api/recipes/download_shopping_cart/',
+            '/api/users/subscriptions/',
+            '/api/users/me/',
+            '/api/tags/',
+            '/api/ingredients/?name=Ingr',
+        ):
+            self.assert_index_scans('get', url)
+
+    def test_writes(self):
+        recipe = self.recipes[5]
+        author = self.authors[2]
+        for method in ('post', 'delete'):
+            for url in (
+                f'/api/recipes/{recipe.id}/favorite/',
+                f'/api/recipes/{recipe.id}/shopping_cart/',
+                f'/api/users/{author.id}/subscribe/',
+            ):
+                self.assert_index_scans(method, url)
+            for url in ('/api/recipes/favorite/batch/',
+                        '/api/recipes/shopping_cart/batch/'):
+                self.assert_index_scans(method, url, {'ids': [recipe.id]})
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class TokenCacheTest(APITestCase):
+    """Tokens are cached as user id and active flag only."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.org', password='pass',
+            first_name='Reader', last_name='User')
+        self.token = Token.objects.create(user=self.user)
+        self.digest = get_digest(self.token.key)
+        self.authentication = CachedTokenAuthentication()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cached_entry(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(cache.get(TOKEN_KEY.format(digest=self.digest)),
+                         (self.user.id, True))
+        local_tokens.delete(self.digest)
+        with self.assertNumQueries(0):
+            user, token = self.authentication.authenticate_credentials(
+                self.token.key)
+            self.assertEqual(user.id, self.user.id)
+            self.assertTrue(user.is_authenticated)
+            self.assertEqual(token.key, self.token.key)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.username, 'reader')
+
+    def test_logout(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(local_tokens.get(self.digest))
+        self.assertIsNone(cache.get(TOKEN_KEY.format(digest=self.digest)))
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_deactivated_user(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class TokenUserQueryTest(RecipeDataMixin, APITestCase):
+    """Views filtered by the token user don't load the user row."""
+
+    def setUp(self):
+        cache.clear()
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        CachedTokenAuthentication().authenticate_credentials(token.key)
+
+    def test_user_filtered_endpoints(self):
+        for url, queries, count in (
+            ('/api/users/subscriptions/', 3, 2),
+            ('/api/recipes/?is_favorited=1', 4, 1),
+            ('/api/recipes/?is_in_shopping_cart=1', 4, 1),
+        ):
+            with self.subTest(url=url):
+                cache.clear()
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['count'], count)
+
+
+@override_settings(CACHES=FAKE_CACHES)
+class MatchIndexTest(RecipeDataMixin, APITestCase):
+    """Recipe changes are applied to the built match index in place."""
+
+    def setUp(self):
+        super().setUp()
+        ingredient_match_index.invalidate()
+        self.index = ingredient_match_index.get()
+
+    def change(self, method, url, data=None):
+        self.client.force_authenticate(self.recipes[3].author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300, response.content)
+
+    def assert_updated(self):
+        with self.assertNumQueries(0):
+            index = ingredient_match_index.get()
+        self.assertIs(index, self.index)
+        rebuilt = build_match_index()
+        for ingredient_ids in ([], [self.ingredients[0].id],
+                               [self.ingredients[1].id,
+                                self.ingredients[3].id],
+                               [ingredient.id
+                                for ingredient in self.ingredients]):
+            with self.subTest(ingredient_ids=ingredient_ids):
+                self.assertEqual(index.match(ingredient_ids, 100),
+                                 rebuilt.match(ingredient_ids, 100))
+
+    def test_recipe_update(self):
+        self.change('patch', f'/api/recipes/{self.recipes[3].id}/', {
+            'ingredients': [{'id': self.ingredients[1].id, 'amount': 1},
+                            {'id': self.ingredients[11].id, 'amount': 2}],
+        })
+        self.assert_updated()
+
+    def test_recipe_delete(self):
+        self.change('delete', f'/api/recipes/{self.recipes[3].id}/')
+        self.assert_updated()
+
+    def test_ingredient_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredients[0].delete()
+        self.assert_updated()
+
+    def test_row_saved(self):
+        recipe = Recipe.objects.create(
+            name='New', text='Text', cooking_time=5, image='recipe.png',
+            author=self.authors[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientsInRecipe.objects.create(
+                recipe=recipe, ingredients=self.ingredients[5], amount=1)
+        self.assert_updated()
+
+    def test_rows_fast_deleted(self):
+        self.assertTrue(Collector(using='default').can_fast_delete(
+            IngredientsInRecipe.objects.all()))
+
+
+@override_settings(CACHES=FAKE_CACHES, SEARCH_INDEX_LIMIT=3)
+class SearchFallbackTest(RecipeDataMixin, APITestCase):
+    """Search without full-text support orders a bounded set of recipes."""
+
+    def setUp(self):
+        super().setUp()
+        recipe_search_index.invalidate()
+
+    def test_results_limited(self):
+        if uses_search_vector():
+            self.skipTest('Full-text search is used on this database.')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/',
+                                       {'search': 'recipe', 'limit': 100})
+        self.assertEqual(
+            [recipe['id'] for recipe in response.json()['results']],
+            [recipe.id for recipe in self.recipes[:3]])
+        self.assertLessEqual(
+            max(query['sql'].count('WHEN')
+                for query in context.captured_queries), 3)
+
+    def test_filtered_results(self):
+        if uses_search_vector():
+            self.skipTest('Full-text search is used on this database.')
+        author = self.authors[2]
+        # Small querysets are scored directly, larger ones in chunks.
+        for chunk_limit in (10000, 2):
+            with self.subTest(chunk_limit=chunk_limit), mock.patch(
+                    'recipes.search.SEARCH_CHUNK_LIMIT', chunk_limit):
+                cache.clear()
+                response = self.client.get('/api/recipes/', {
+                    'search': 'recipe', 'author': author.id, 'limit': 100})
+                self.assertEqual(
+                    [recipe['id'] for recipe in response.json()['results']],
+                    [recipe.id for recipe in self.recipes[2::3][:3]])
+
+    def test_cursor_pagination_rejected(self):
+        for params in ({'pagination': 'cursor'}, {'cursor': 'abc'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/recipes/',
+                                           {'search': 'recipe', **params})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('search', response.json())
+
+
+class Base64ImageFieldTest(APITestCase):
+    """Uploaded images are checked before they reach the image worker."""
+
+    def encode(self, content):
+        return f'data:image/png;base64,{b64encode(content).decode()}'
+
+    def get_png(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_valid_image(self):
+        file = Base64ImageField().to_internal_value(
+            self.encode(self.get_png()))
+        self.assertTrue(file.name.endswith('.png'))
+        self.assertEqual(file.read(), self.get_png())
+
+    def test_corrupted_image(self):
+        content = bytearray(self.get_png())
+        content[20:24] = b'\0\0\0\0'
+        for data in (bytes(content), self.get_png()[:30]):
+            with self.subTest(size=len(data)):
+                with self.assertRaises(ValidationError) as context:
+                    Base64ImageField().to_internal_value(self.encode(data))
+                self.assertEqual(context.exception.get_codes(),
+                                 ['invalid_image'])
+
+    def get_noise_png(self):
+        buffer = io.BytesIO()
+        Image.frombytes('RGB', (32, 32), bytes(range(256)) * 12).save(
+            buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_size_limit(self):
+        content = self.get_noise_png()
+        with override_settings(IMAGE_UPLOAD_MAX_SIZE=len(content)):
+            Base64ImageField().to_internal_value(self.encode(content))
+        with override_settings(IMAGE_UPLOAD_MAX_SIZE=len(content) - 1):
+            with self.assertRaises(ValidationError) as context:
+                Base64ImageField().to_internal_value(self.encode(content))
+            self.assertEqual(context.exception.get_codes(), ['too_large'])
+        with override_settings(IMAGE_UPLOAD_MAX_SIZE=100):
+            # Oversized payloads are rejected before they are decoded.
+            with self.assertRaises(ValidationError) as context:
+                Base64ImageField().to_internal_value(
+                    'data:image/png;base64,' + '!' * 1000)
+            self.assertEqual(context.exception.get_codes(), ['too_large'])
+
+    def test_chunk_boundaries(self):
+        content = self.get_noise_png()
+        encoded = b64encode(content).decode()
+        wrapped = '\n'.join(encoded[start:start + 76]
+                            for start in range(0, len(encoded), 76))
+        for chunk_size in (1, 3, 4, 5, 77, 1000):
+            for data in (encoded, wrapped):
+                with self.subTest(chunk_size=chunk_size,
+                                  wrapped=data is wrapped):
+                    with mock.patch('api.fields.CHUNK_SIZE', chunk_size):
+                        file = Base64ImageField().to_internal_value(
+                            f'data:image/png;base64,{data}')
+                    self.assertEqual(file.read(), content)
+
+    def test_invalid_data(self):
+        for data, code in (
+                ('data:image/png,abc', 'invalid_base64'),
+                ('data:image/png;base64,ab$c', 'invalid_base64'),
+                ('data:image/png;base64,abc', 'invalid_base64'),
+                (self.encode(b'<svg onload="alert(1)"/>'), 'unsupported')):
+            with self.subTest(code=code, data=data):
+                with self.assertRaises(ValidationError) as context:
+                    Base64ImageField().to_internal_value(data)
+                self.assertEqual(context.exception.get_codes(), [code])
+
+    def test_multipart_upload(self):
+        field = Base64ImageField()
+        file = field.to_internal_value(
+            SimpleUploadedFile('image.png', self.get_png()))
+        self.assertEqual(file.read(), self.get_png())
+        for content, code in (
+                (b'<script>alert(1)</script>', 'unsupported'),
+                (self.get_png()[:30], 'invalid_image')):
+            with self.subTest(code=code):
+                with self.assertRaises(ValidationError) as context:
+                    field.to_internal_value(
+                        SimpleUploadedFile('evil.png', content))
+                self.assertEqual(context.exception.get_codes(), [code])
+        with override_settings(IMAGE_UPLOAD_MAX_SIZE=10):
+            with self.assertRaises(ValidationError) as context:
+                field.to_internal_value(
+                    SimpleUploadedFile('image.png', self.get_png()))
+            self.assertEqual(context.exception.get_codes(), ['too_large'])
+
+
+class ImportRecipesTest(APITestCase):
+    """Imported images are only written once the chunk is committed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.org', password='pass')
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(self.media.cleanup)
+        id_maps.clear()
+        self.addCleanup(id_maps.clear)
+        os.makedirs(os.path.join(self.directory.name, 'images'))
+        with open(os.path.join(self.directory.name, 'images', 'soup.png'),
+                  'wb') as image:
+            image.write(b'image')
+        self.line = json.dumps({
+            'author': 'author', 'name': 'Soup', 'text': 'Text',
+            'cooking_time': 10, 'image': 'images/soup.png',
+            'pub_date': '2022-01-01T00:00:00+00:00',
+            'ingredients': [{'name': 'Salt', 'measurement_unit': 'g',
+                             'amount': 5}],
+            'tags': [],
+        })
+
+    def test_images_saved_on_commit(self):
+        with override_settings(MEDIA_ROOT=self.media.name):
+            with self.captureOnCommitCallbacks() as callbacks:
+                counts = import_chunk([self.line], self.directory.name)
+            self.assertEqual(counts['imported'], 1)
+            image = Recipe.objects.get(name='Soup').image
+            self.assertFalse(image.storage.exists(image.name))
+            for callback in callbacks:
+                callback()
+            with image.open('rb') as file:
+                self.assertEqual(file.read(), b'image')
+
+    def test_parallel_workers_on_sqlite(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Only SQLite is limited to one writer.')
+        with self.assertRaisesMessage(CommandError, '--workers 1'):
+            call_command('importrecipes', self.directory.name, workers=2)
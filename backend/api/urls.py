@@ -1,8 +1,9 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import (IngredientViewSet, RecipeViewSet, SubscribeView,
-                    SubscriptionsView, TagViewSet)
+from .views import (IngredientViewSet, RecipeMatchView, RecipeViewSet,
+                    SubscribeBatchView, SubscribeView, SubscriptionsView,
+                    TagViewSet)
 
 router = DefaultRouter()
 
@@ -11,6 +12,16 @@ router.register('tags', TagViewSet)
 router.register('recipes', RecipeViewSet)
 
 urlpatterns = [
+    path(
+        'recipes/matching/',
+        RecipeMatchView.as_view(),
+        name='recipe-matching'
+    ),
+    path(
+        'users/subscribe/batch/',
+        SubscribeBatchView.as_view(),
+        name='subscribe-batch'
+    ),
     path(
         'users/<int:id>/subscribe/',
         SubscribeView.as_view(),
@@ -0,0 +1,56 @@
+from django.db import connections, router
+
+
+def insert_ignore(model, rows, returning=None):
+    """
+    Inserts rows with ON CONFLICT DO NOTHING in a single statement.
+
+    Rows are dicts keyed by field attnames. Returns the number of rows
+    actually inserted, which bulk_create(ignore_conflicts=True) can't tell,
+    or with `returning` set to an attname, its values in the inserted rows.
+    """
+    if not rows:
+        return 0 if returning is None else []
+    fields = [model._meta.get_field(name) for name in rows[0]]
+    connection = connections[router.db_for_write(model)]
+    quote_name = connection.ops.quote_name
+    row_placeholder = '({})'.format(', '.join(['%s'] * len(fields)))
+    sql = 'INSERT INTO {} ({}) VALUES {} ON CONFLICT DO NOTHING'.format(
+        quote_name(model._meta.db_table),
+        ', '.join(quote_name(field.column) for field in fields),
+        ', '.join([row_placeholder] * len(rows))
+    )
+    if returning is not None:
+        sql += ' RETURNING {}'.format(
+            quote_name(model._meta.get_field(returning).column))
+    params = [
+        field.get_db_prep_save(row[field.attname], connection)
+        for row in rows for field in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        if returning is not None:
+            return [value for value, in cursor.fetchall()]
+        return cursor.rowcount
+
+
+def delete_returning(queryset, returning):
+    """
+    Deletes the rows of a queryset in a single statement.
+
+    Returns values of the `returning` attname in the deleted rows, rows
+    removed by a concurrent transaction are not among them. Signals are
+    not sent and cascades are not followed.
+    """
+    model = queryset.model
+    connection = connections[router.db_for_write(model)]
+    quote_name = connection.ops.quote_name
+    pk_column = quote_name(model._meta.pk.column)
+    subquery, params = queryset.values('pk').query.get_compiler(
+        connection=connection).as_sql()
+    sql = 'DELETE FROM {} WHERE {} IN ({}) RETURNING {}'.format(
+        quote_name(model._meta.db_table), pk_column, subquery,
+        quote_name(model._meta.get_field(returning).column))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [value for value, in cursor.fetchall()]
@@ -1,6 +1,9 @@
-from django.db.models import F, Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Prefetch, Value
 from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.decorators import action
@@ -10,72 +13,238 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
+from recipes import popularity, shopping_list, timeline
+from recipes.autocomplete import ingredient_autocomplete
+from recipes.matching import ingredient_match_index
 from recipes.models import (Favorite, Ingredient, IngredientsInRecipe, Recipe,
                             ShoppingCart, Tag)
 from users.models import Subscription, User
 
-from .filters import IngredientFilter, RecipeFilter
-from .pagination import CustomPagination
-from .permissions import AuthCheck
-from .serializers import (FavoriteSerializer, IngredientSerializer,
-                          RecipeSerializer, RecipeSerializerCreate,
-                          ShoppingCartSerializer, ShowSubscriptionsSerializer,
-                          SubscriptionSerializer, TagSerializer)
+from .cache import (RecipeFeedCacheMixin, ReferenceCacheMixin, get_feed_stats,
+                    invalidate_popularity)
+from .exporters import EXPORTERS, ExportContentNegotiation, get_shopping_list
+from .filters import ORDERINGS, RecipeFilter
+from .pagination import CustomPagination, KeysetPagination, TimelinePagination
+from .permissions import AuthCheck, IsAdmin
+from .representations import (CARD_FIELDS, USER_FLAGS, RecipeRepresentation,
+                              SubscriptionRepresentation, select_fields)
+from .serializers import (BatchSerializer, IngredientSerializer,
+                          MatchedRecipeSerializer, RecipeSerializer,
+                          RecipeSerializerCreate, ShowRecipesSerializer,
+                          ShowSubscriptionsSerializer, TagSerializer)
+from .utils import delete_returning, insert_ignore
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+def annotate_user_flags(user, queryset, flags=USER_FLAGS):
+    if user.is_anonymous:
+        return queryset.annotate(**{flag: Value(False) for flag in flags})
+    annotations = {
+        'is_favorited': Exists(Favorite.objects.filter(
+            owner_id=user.id, favorite=OuterRef('pk'))),
+        'is_in_shopping_cart': Exists(ShoppingCart.objects.filter(
+            customer_id=user.id, purchase=OuterRef('pk'))),
+        'author_is_subscribed': Exists(Subscription.objects.filter(
+            subscriber_id=user.id, subscription=OuterRef('author'))),
+    }
+    return queryset.annotate(**{flag: annotations[flag] for flag in flags})
+
+
+def get_recipe_queryset(user, queryset=None):
+    """Recipes with related data and per-user flags loaded in bulk."""
+    if queryset is None:
+        queryset = Recipe.objects.all()
+    queryset = queryset.select_related('author').prefetch_related(
+        'tags',
+        Prefetch(
+            'ingredients_for_recipe',
+            queryset=IngredientsInRecipe.objects.select_related('ingredients')
+        )
+    )
+    return annotate_user_flags(user, queryset)
+
+
+def get_recipe_rows(user, queryset=None,
+                    fields=RecipeRepresentation.fields):
+    """Recipe value rows RecipeRepresentation needs to output `fields`."""
+    if queryset is None:
+        queryset = Recipe.objects.all()
+    columns = RecipeRepresentation.get_columns(fields)
+    queryset = annotate_user_flags(
+        user, queryset, [flag for flag in USER_FLAGS if flag in columns])
+    return queryset.values(*columns)
+
+
+def get_subscription_rows(user, fields=SubscriptionRepresentation.fields):
+    """Followed authors as rows SubscriptionRepresentation needs."""
+    queryset = User.objects.filter(subscription__subscriber_id=user.id)
+    if 'recipes_count' in fields:
+        queryset = queryset.annotate(
+            recipes_count=Count('my_recipes', distinct=True))
+    return queryset.order_by('username').values(
+        *SubscriptionRepresentation.get_columns(fields))
+
+
+def change_popularity(model, recipe_ids, delta):
+    """Changes popularity counters and drops pages ordered by them."""
+    popularity.change_count(model, recipe_ids, delta)
+    invalidate_popularity()
+
+
+def process_batch(request, targets, model, user_field, target_field,
+                  invalid=()):
+    """
+    Adds or removes links between the user and a batch of objects.
+
+    Returns ids of changed objects and a response with a status per id.
+    Only rows this statement actually inserted or deleted count as
+    changed, so overlapping batches don't apply side effects twice.
+    """
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = list(dict.fromkeys(serializer.validated_data['ids']))
+    if request.method == 'DELETE':
+        deleted = set(delete_returning(model.objects.filter(**{
+            f'{user_field}_id': request.user.id,
+            f'{target_field}_id__in': ids
+        }), f'{target_field}_id'))
+        return [pk for pk in ids if pk in deleted], Response({'results': [
+            {'id': pk, 'status': 'deleted' if pk in deleted else 'not_found'}
+            for pk in ids
+        ]})
+    existing = set(targets.filter(id__in=ids).values_list('id', flat=True))
+    created = set(insert_ignore(model, [
+        {f'{user_field}_id': request.user.id, f'{target_field}_id': pk}
+        for pk in ids if pk in existing and pk not in invalid
+    ], returning=f'{target_field}_id'))
+    results = []
+    for pk in ids:
+        if pk in invalid:
+            result = 'invalid'
+        elif pk not in existing:
+            result = 'not_found'
+        elif pk in created:
+            result = 'created'
+        else:
+            result = 'already_exists'
+        results.append({'id': pk, 'status': result})
+    return [pk for pk in ids if pk in created], Response({'results': results})
+
+
+class TagViewSet(ReferenceCacheMixin, ReadOnlyModelViewSet):
+    cache_scope = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, ReadOnlyModelViewSet):
+    cache_scope = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (IngredientFilter,)
     pagination_class = None
-    search_fields = ('^name',)
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit')
+        ingredients = ingredient_autocomplete.search(
+            name, int(limit) if limit and limit.isdigit() else None)
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
 
 
 class SubscribeView(APIView):
     permission_classes = (IsAuthenticated,)
 
     def post(self, request, id):
-        data = {
-            'subscriber': request.user.id,
-            'subscription': id
-        }
-        serializer = SubscriptionSerializer(
-            data=data,
-            context={'request': request}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        if request.user.id == id:
+            return Response(
+                {'non_field_errors': ["Can't subscribe to yourself."]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        author = get_object_or_404(User, id=id)
+        if not insert_ignore(Subscription, [
+            {'subscriber_id': request.user.id, 'subscription_id': id}
+        ]):
+            return Response({'non_field_errors': ['Already subscribed.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        timeline.backfill(request.user, [id])
+        author.is_subscribed = True
+        serializer = ShowSubscriptionsSerializer(
+            author, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, id):
-        author = get_object_or_404(User, id=id)
-        if Subscription.objects.filter(
-           subscriber=request.user, subscription=author).exists():
-            Subscription.objects.filter(
-                subscriber=request.user, subscription=author).delete()
+        deleted, _ = Subscription.objects.filter(
+            subscriber_id=request.user.id, subscription_id=id).delete()
+        if deleted:
+            timeline.remove_authors(request.user, [id])
             return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        return Response({'non_field_errors': ['Not subscribed.']},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+
+class SubscribeBatchView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        changed, response = process_batch(
+            request, User.objects.all(), Subscription, 'subscriber',
+            'subscription', invalid={request.user.id})
+        if changed:
+            timeline.backfill(request.user, changed)
+        return response
+
+    def delete(self, request):
+        changed, response = process_batch(
+            request, User.objects.all(), Subscription, 'subscriber',
+            'subscription')
+        if changed:
+            timeline.remove_authors(request.user, changed)
+        return response
 
 
 class SubscriptionsView(ListAPIView):
     permission_classes = (IsAuthenticated,)
     pagination_class = CustomPagination
+    keyset_ordering = ('username', 'id')
 
     def get(self, request):
-        queryset = User.objects.filter(subscription__subscriber=request.user)
-        page = self.paginate_queryset(queryset)
-        serializer = ShowSubscriptionsSerializer(page, many=True,
-                                                 context={'request': request})
-        return self.get_paginated_response(serializer.data)
+        fields = select_fields(request, SubscriptionRepresentation.fields)
+        page = self.paginate_queryset(
+            get_subscription_rows(request.user, fields))
+        representation = SubscriptionRepresentation(
+            page, many=True, context={'request': request}, fields=fields)
+        return self.get_paginated_response(representation.data)
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeMatchView(APIView):
+
+    def get(self, request):
+        ingredient_ids = [
+            int(value)
+            for param in request.query_params.getlist('ingredients')
+            for value in param.split(',') if value.strip().isdigit()
+        ]
+        limit = request.query_params.get('limit')
+        limit = min(int(limit), settings.RECIPE_MATCH_LIMIT) if (
+            limit and limit.isdigit()) else settings.RECIPE_MATCH_LIMIT
+        matches = ingredient_match_index.get().match(ingredient_ids, limit)
+        recipes = Recipe.objects.in_bulk(
+            [recipe_id for recipe_id, _, _ in matches])
+        results = []
+        for recipe_id, coverage, missing in matches:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.coverage, recipe.missing = coverage, missing
+                results.append(recipe)
+        serializer = MatchedRecipeSerializer(results, many=True,
+                                             context={'request': request})
+        return Response(serializer.data)
+
+
+class RecipeViewSet(RecipeFeedCacheMixin, ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     pagination_class = CustomPagination
@@ -83,60 +252,168 @@ class RecipeViewSet(ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    @property
+    def keyset_ordering(self):
+        return ORDERINGS.get(self.request.query_params.get('ordering'),
+                             KeysetPagination.ordering)
+
+    @property
+    def read_only_rows(self):
+        return (self.request.method == 'GET'
+                and self.action in ('list', 'retrieve'))
+
+    @cached_property
+    def output_fields(self):
+        """Fields picked with `fields` and `omit`, cards on request."""
+        card = self.request.query_params.get('representation') == 'card'
+        return select_fields(self.request, RecipeRepresentation.fields,
+                             CARD_FIELDS if card else None)
+
+    def get_queryset(self):
+        user = AnonymousUser() if self.shared_page else self.request.user
+        if self.read_only_rows:
+            return get_recipe_rows(user, fields=self.output_fields)
+        return get_recipe_queryset(user)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.read_only_rows:
+            kwargs.setdefault('context', self.get_serializer_context())
+            return RecipeRepresentation(*args, fields=self.output_fields,
+                                        **kwargs)
+        return super().get_serializer(*args, **kwargs)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        shopping_list.update_recipe(
+            instance, shopping_list.get_recipe_amounts(instance), {})
+        instance.delete()
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeSerializer
         return RecipeSerializerCreate
 
+    def add_to_list(self, request, pk, model, user_field, recipe_field,
+                    error):
+        recipe = get_object_or_404(
+            Recipe.objects.only('id', 'name', 'image', 'cooking_time'),
+            id=pk
+        )
+        with transaction.atomic():
+            if not insert_ignore(model, [
+                {f'{user_field}_id': request.user.id,
+                 f'{recipe_field}_id': pk}
+            ]):
+                return None, Response({'non_field_errors': [error]},
+                                      status=status.HTTP_400_BAD_REQUEST)
+            change_popularity(model, [pk], 1)
+        serializer = ShowRecipesSerializer(recipe,
+                                           context={'request': request})
+        return recipe, Response(serializer.data,
+                                status=status.HTTP_201_CREATED)
+
+    def remove_from_list(self, request, pk, model, user_field, recipe_field,
+                         error):
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(**{
+                f'{user_field}_id': request.user.id, f'{recipe_field}_id': pk
+            }).delete()
+            if not deleted:
+                return False, Response({'non_field_errors': [error]},
+                                       status=status.HTTP_400_BAD_REQUEST)
+            change_popularity(model, [pk], -1)
+        return True, Response(status=status.HTTP_204_NO_CONTENT)
+
     @action(detail=True, methods=['post', 'delete'])
     def favorite(self, request, pk):
         if request.method == 'POST':
-            data = {'owner': request.user.id, 'favorite': pk}
-            serializer = FavoriteSerializer(data=data,
-                                            context={'request': request})
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        recipe = get_object_or_404(Recipe, id=pk)
-        favorite = get_object_or_404(Favorite, owner=request.user,
-                                     favorite=recipe)
-        favorite.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+            _, response = self.add_to_list(
+                request, pk, Favorite, 'owner', 'favorite',
+                'Already in favorites.')
+            return response
+        _, response = self.remove_from_list(
+            request, pk, Favorite, 'owner', 'favorite',
+            'Not in favorites.')
+        return response
 
     @action(detail=True, methods=['post', 'delete'])
+    @transaction.atomic
     def shopping_cart(self, request, pk):
         if request.method == 'POST':
-            data = {'customer': request.user.id, 'purchase': pk}
-            serializer = ShoppingCartSerializer(data=data,
-                                                context={'request': request})
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        recipe = get_object_or_404(Recipe, id=pk)
-        purchase = get_object_or_404(ShoppingCart, customer=request.user,
-                                     purchase=recipe)
-        purchase.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
-
-    @action(detail=False, methods=['get'])
-    def download_shopping_cart(self, request):
-        shopping_cart = IngredientsInRecipe.objects.filter(
-            recipe__shopping_cart__customer=request.user
-        ).values(
-            name=F('ingredients__name'),
-            measurement_unit=F('ingredients__measurement_unit')
-        ).annotate(ingredients_sum=Sum('amount')).values_list(
-            'ingredients__name',
-            'ingredients_sum',
-            'ingredients__measurement_unit'
+            recipe, response = self.add_to_list(
+                request, pk, ShoppingCart, 'customer', 'purchase',
+                'Already in shopping list.')
+            if recipe is not None:
+                shopping_list.add_recipe(request.user, recipe)
+            return response
+        deleted, response = self.remove_from_list(
+            request, pk, ShoppingCart, 'customer', 'purchase',
+            'Not in shopping list.')
+        if deleted:
+            shopping_list.remove_recipe(request.user, pk)
+        return response
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='favorite/batch', permission_classes=(IsAuthenticated,))
+    @transaction.atomic
+    def favorite_batch(self, request):
+        changed, response = process_batch(
+            request, Recipe.objects.all(), Favorite, 'owner', 'favorite')
+        if changed:
+            change_popularity(
+                Favorite, changed, -1 if request.method == 'DELETE' else 1)
+        return response
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='shopping_cart/batch',
+            permission_classes=(IsAuthenticated,))
+    @transaction.atomic
+    def shopping_cart_batch(self, request):
+        changed, response = process_batch(
+            request, Recipe.objects.all(), ShoppingCart, 'customer',
+            'purchase')
+        if not changed:
+            return response
+        if request.method == 'DELETE':
+            shopping_list.remove_recipes(request.user, changed)
+            change_popularity(ShoppingCart, changed, -1)
+        else:
+            shopping_list.add_recipes(request.user, changed)
+            change_popularity(ShoppingCart, changed, 1)
+        return response
+
+    @action(detail=False, methods=['get'],
+            permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        paginator = TimelinePagination()
+        page = paginator.paginate_sources(
+            timeline.get_sources(request.user), request)
+        recipes = {
+            recipe['id']: recipe
+            for recipe in get_recipe_rows(
+                request.user, fields=self.output_fields
+            ).filter(id__in=[recipe_id for _, recipe_id in page])
+        }
+        representation = RecipeRepresentation(
+            [recipes[recipe_id] for _, recipe_id in page
+             if recipe_id in recipes],
+            many=True, context={'request': request},
+            fields=self.output_fields
         )
-        response = HttpResponse(content_type='text/plain')
-        response['Content-Disposition'] = 'attachment; filename=shopping.txt'
-        shopping_cart_list = ['Shopping List:\n']
-        for ingredients in shopping_cart:
-            ingredient, amount, meaurement_unit, = ingredients
-            shopping_cart_list.append(
-                f'{ingredient} - {amount} {meaurement_unit}\n'
+        return paginator.get_paginated_response(representation.data)
+
+    @action(detail=False, methods=['get'], permission_classes=(IsAdmin,))
+    def cache_stats(self, request):
+        return Response(get_feed_stats())
+
+    @action(detail=False, methods=['get'],
+            permission_classes=(IsAuthenticated,),
+            content_negotiation_class=ExportContentNegotiation)
+    def download_shopping_cart(self, request):
+        exporter = EXPORTERS.get(request.query_params.get('format', 'txt'))
+        if exporter is None:
+            return Response(
+                {'format': f'Available formats: {", ".join(EXPORTERS)}.'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        response.writelines(shopping_cart_list)
-        return response
+        return exporter(get_shopping_list(request.user)).get_response()
@@ -62,6 +62,33 @@ DATABASES = {
         'PORT': os.getenv('DB_PORT', default='5432')
     }
 }
+if os.getenv('CACHE_BACKEND', default='locmem') == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL',
+                                  default='redis://redis:6379/0'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+REFERENCE_CACHE_TIMEOUT = int(
+    os.getenv('REFERENCE_CACHE_TIMEOUT', default=24 * 60 * 60)
+)
+RECIPE_FEED_CACHE_TIMEOUT = int(
+    os.getenv('RECIPE_FEED_CACHE_TIMEOUT', default=5 * 60)
+)
+IMAGE_UPLOAD_MAX_SIZE = int(
+    os.getenv('IMAGE_UPLOAD_MAX_SIZE', default=10 * 1024 * 1024)
+)
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', default='russian')
+SEARCH_INDEX_TTL = int(os.getenv('SEARCH_INDEX_TTL', default=300))
+SEARCH_INDEX_LIMIT = int(os.getenv('SEARCH_INDEX_LIMIT', default=500))
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', default=100))
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -92,7 +119,16 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
@@ -115,3 +151,18 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=10),
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
+INGREDIENT_AUTOCOMPLETE_LIMIT = int(
+    os.getenv('INGREDIENT_AUTOCOMPLETE_LIMIT', default=20)
+)
+INGREDIENT_AUTOCOMPLETE_TTL = int(
+    os.getenv('INGREDIENT_AUTOCOMPLETE_TTL', default=300)
+)
+RECIPE_MATCH_LIMIT = int(os.getenv('RECIPE_MATCH_LIMIT', default=20))
+RECIPE_MATCH_TTL = int(os.getenv('RECIPE_MATCH_TTL', default=300))
+TIMELINE_MAX_SIZE = int(os.getenv('TIMELINE_MAX_SIZE', default=500))
+TIMELINE_FANOUT_LIMIT = int(os.getenv('TIMELINE_FANOUT_LIMIT', default=1000))
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', default=60))
+TOKEN_CACHE_LOCAL_TTL = int(os.getenv('TOKEN_CACHE_LOCAL_TTL', default=5))
+TOKEN_CACHE_LOCAL_SIZE = int(
+    os.getenv('TOKEN_CACHE_LOCAL_SIZE', default=10000)
+)
@@ -1,17 +1,14 @@
 from django.contrib import admin
 
 from .models import (Favorite, Ingredient, IngredientsInRecipe, Recipe,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingListItem, Tag, TimelineEntry)
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'favorite',)
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count',)
     list_filter = ('author', 'name', 'tags',)
 
-    def favorite(self, obj):
-        return obj.favorite.all().count()
-
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
@@ -22,4 +19,6 @@ class IngredientAdmin(admin.ModelAdmin):
 admin.site.register(Favorite)
 admin.site.register(IngredientsInRecipe)
 admin.site.register(ShoppingCart)
+admin.site.register(ShoppingListItem)
 admin.site.register(Tag)
+admin.site.register(TimelineEntry)
@@ -0,0 +1,197 @@
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Ingredient
+from .utils import LazyIndex
+
+WORD_SPLIT = re.compile(r'[\s\-,.()/]+')
+UPPER_BOUND = '\uffff'
+FUZZY_POSTING_LIMIT = 5000
+FUZZY_CANDIDATE_LIMIT = 1000
+
+
+def normalize(value):
+    """Case- and ё/е-insensitive search key."""
+    return value.casefold().replace('ё', 'е').strip()
+
+
+def get_words(key):
+    """Suffixes of the key starting at its second and later words."""
+    return {key[match.end():] for match in WORD_SPLIT.finditer(key)
+            if match.end() < len(key)}
+
+
+def trigrams(value):
+    padded = f'  {value} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class IngredientIndex:
+    """
+    In-memory ingredient index for autocomplete.
+
+    Names are kept in sorted lists of (key, id) so prefix lookups are two
+    bisects. Matches at the start of the name rank first, then matches at
+    the start of any other word and then trigram-similar names. add() and
+    remove() change the index in place.
+    """
+
+    def __init__(self, rows):
+        self.ingredients = {}
+        self.keys = []
+        self.word_keys = []
+        self.trigram_index = {}
+        for pk, name, unit in rows:
+            key = normalize(name)
+            self.ingredients[pk] = (key, name, unit)
+            self.keys.append((key, pk))
+            self.word_keys.extend((word, pk) for word in get_words(key))
+            self._add_trigrams(key, pk)
+        self.keys.sort()
+        self.word_keys.sort()
+
+    def __len__(self):
+        return len(self.ingredients)
+
+    def _add_trigrams(self, key, pk):
+        for trigram in trigrams(key):
+            self.trigram_index.setdefault(trigram, {})[pk] = None
+
+    def add(self, pk, name, unit):
+        """Adds or replaces an ingredient, returns the index."""
+        self.remove(pk)
+        key = normalize(name)
+        self.ingredients[pk] = (key, name, unit)
+        insort(self.keys, (key, pk))
+        for word in get_words(key):
+            insort(self.word_keys, (word, pk))
+        self._add_trigrams(key, pk)
+        return self
+
+    def remove(self, pk):
+        """Removes an ingredient if present, returns the index."""
+        ingredient = self.ingredients.pop(pk, None)
+        if ingredient is None:
+            return self
+        key = ingredient[0]
+        del self.keys[bisect_left(self.keys, (key, pk))]
+        for word in get_words(key):
+            del self.word_keys[bisect_left(self.word_keys, (word, pk))]
+        for trigram in trigrams(key):
+            posting = self.trigram_index[trigram]
+            del posting[pk]
+            if not posting:
+                del self.trigram_index[trigram]
+        return self
+
+    def _prefix_range(self, keys, query):
+        return (bisect_left(keys, (query,)),
+                bisect_left(keys, (query + UPPER_BOUND,)))
+
+    def _fuzzy(self, query, limit, found):
+        """
+        Trigram-similar names, most similar first.
+
+        Only the first FUZZY_POSTING_LIMIT names of a trigram and the
+        FUZZY_CANDIDATE_LIMIT names sharing most trigrams are scored,
+        which bounds the work on large catalogues.
+        """
+        query_trigrams = trigrams(query)
+        threshold = max(1, len(query_trigrams) // 3)
+        counts = Counter()
+        truncated = 0
+        for trigram in query_trigrams:
+            posting = self.trigram_index.get(trigram, {}).keys()
+            if len(posting) > FUZZY_POSTING_LIMIT:
+                truncated += 1
+                posting = islice(posting, FUZZY_POSTING_LIMIT)
+            counts.update(posting)
+        scored = []
+        for pk, shared in counts.most_common(FUZZY_CANDIDATE_LIMIT):
+            if shared + truncated < threshold:
+                break
+            if pk in found:
+                continue
+            key = self.ingredients[pk][0]
+            key_trigrams = trigrams(key)
+            if truncated:
+                shared = len(query_trigrams & key_trigrams)
+                if shared < threshold:
+                    continue
+            similarity = shared / (
+                len(query_trigrams) + len(key_trigrams) - shared)
+            scored.append((-similarity, key, pk))
+        scored.sort()
+        return [pk for _, _, pk in scored[:limit]]
+
+    def search(self, query, limit):
+        query = normalize(query)
+        if not query or limit <= 0:
+            return []
+        start, end = self._prefix_range(self.keys, query)
+        ids = [pk for _, pk in self.keys[start:min(end, start + limit)]]
+        found = set(ids)
+        if len(ids) < limit:
+            start, end = self._prefix_range(self.word_keys, query)
+            for position in range(start, end):
+                pk = self.word_keys[position][1]
+                if pk not in found:
+                    found.add(pk)
+                    ids.append(pk)
+                    if len(ids) == limit:
+                        break
+        if len(ids) < limit and len(query) >= 3:
+            ids.extend(self._fuzzy(query, limit - len(ids), found))
+        return [
+            {
+                'id': pk,
+                'name': self.ingredients[pk][1],
+                'measurement_unit': self.ingredients[pk][2],
+            }
+            for pk in ids
+        ]
+
+
+def build_ingredient_index():
+    return IngredientIndex(Ingredient.objects.values_list(
+        'id', 'name', 'measurement_unit').iterator())
+
+
+class IngredientAutocomplete:
+    """
+    Lazily built ingredient index shared by the process.
+
+    Saved and deleted ingredients are applied to the built index once
+    committed, so it is only rebuilt in the background after its ttl.
+    """
+
+    def __init__(self):
+        self.index = LazyIndex(build_ingredient_index,
+                               'INGREDIENT_AUTOCOMPLETE_TTL')
+
+    def invalidate(self):
+        self.index.invalidate()
+
+    def update(self, ingredient):
+        pk, name, unit = (ingredient.id, ingredient.name,
+                          ingredient.measurement_unit)
+        transaction.on_commit(lambda: self.index.update(
+            lambda index: index.add(pk, name, unit)))
+
+    def remove(self, pk):
+        transaction.on_commit(lambda: self.index.update(
+            lambda index: index.remove(pk)))
+
+    def search(self, query, limit=None):
+        max_limit = settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        if limit is None or limit > max_limit:
+            limit = max_limit
+        return self.index.get().search(query, limit)
+
+
+ingredient_autocomplete = IngredientAutocomplete()
@@ -0,0 +1,59 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+VARIANT_WIDTHS = {
+    'thumbnail': 160,
+    'small': 320,
+    'medium': 640,
+    'large': 1280,
+}
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+VARIANTS_PATH = 'recipes/variants'
+
+
+def save_image(image, path, image_format, options):
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return default_storage.save(path, ContentFile(buffer.getvalue()))
+
+
+def process_image(path):
+    """
+    Validates an uploaded image and renders its variants.
+
+    Runs in worker processes and only touches the storage, the caller
+    stores returned paths on the recipe. Returns the path of the original
+    with metadata stripped and {variant: {format: path}}.
+    """
+    with default_storage.open(path) as source:
+        image = Image.open(source)
+        image.verify()
+    with default_storage.open(path) as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    stem = os.path.splitext(os.path.basename(path))[0]
+    flat = image.convert('RGB')
+    original = save_image(
+        flat, f'recipes/images/{stem}.jpeg', *VARIANT_FORMATS['jpeg'])
+    variants = {}
+    for name, width in VARIANT_WIDTHS.items():
+        resized = image.copy()
+        resized.thumbnail((width, width * 4))
+        variants[name] = {}
+        for extension, (image_format, options) in VARIANT_FORMATS.items():
+            variant = resized if image_format == 'WEBP' else (
+                resized.convert('RGB'))
+            variants[name][extension] = save_image(
+                variant, f'{VARIANTS_PATH}/{stem}_{name}.{extension}',
+                image_format, options
+            )
+    return original, variants
@@ -0,0 +1,138 @@
+import csv
+import json
+import re
+from io import StringIO
+from itertools import islice
+
+from django.db import connection
+
+from .models import Ingredient
+
+FORMATS = ('csv', 'json', 'ndjson')
+READ_SIZE = 64 * 1024
+LOOKUP_SIZE = 500
+SEPARATORS = re.compile(r'[\s,]*')
+STAGING_TABLE = 'ingredient_import'
+
+
+def read_csv(file):
+    for line in csv.reader(file):
+        if len(line) >= 2:
+            yield line[0], line[1]
+
+
+def read_ndjson(file):
+    for line in file:
+        if line.strip():
+            item = json.loads(line)
+            yield item['name'], item['measurement_unit']
+
+
+def decode_items(decoder, buffer, final):
+    """JSON values separated by commas and where the next one starts."""
+    items, position = [], 0
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if position == len(buffer) or buffer[position] == ']':
+            return items, position
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return items, position
+        items.append(item)
+
+
+def read_json(file):
+    """Items of a top-level JSON array, decoded one chunk at a time."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Expected a JSON array.')
+    buffer = buffer[1:]
+    while True:
+        chunk = file.read(READ_SIZE)
+        buffer += chunk
+        items, position = decode_items(decoder, buffer, final=not chunk)
+        for item in items:
+            yield item['name'], item['measurement_unit']
+        buffer = buffer[position:]
+        if not chunk:
+            return
+
+
+READERS = {'csv': read_csv, 'json': read_json, 'ndjson': read_ndjson}
+
+
+def read_ingredients(file, file_format):
+    """Stripped (name, measurement_unit) pairs, blank ones are skipped."""
+    for name, measurement_unit in READERS[file_format](file):
+        name, measurement_unit = name.strip(), measurement_unit.strip()
+        if name and measurement_unit:
+            yield name, measurement_unit
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def insert_batch(batch):
+    batch = set(batch)
+    existing = set()
+    for names in batched({name for name, _ in batch}, LOOKUP_SIZE):
+        existing.update(Ingredient.objects.filter(name__in=names).values_list(
+            'name', 'measurement_unit'))
+    new = batch - existing
+    Ingredient.objects.bulk_create(
+        (Ingredient(name=name, measurement_unit=measurement_unit)
+         for name, measurement_unit in new),
+        ignore_conflicts=True
+    )
+    return len(new)
+
+
+def copy_batch(cursor, batch):
+    buffer = StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+    cursor.execute(f'TRUNCATE {STAGING_TABLE}')
+    cursor.copy_expert(
+        f'COPY {STAGING_TABLE} (name, measurement_unit) '
+        f'FROM STDIN WITH (FORMAT csv)', buffer)
+    cursor.execute(
+        f'INSERT INTO {Ingredient._meta.db_table} (name, measurement_unit) '
+        f'SELECT DISTINCT name, measurement_unit FROM {STAGING_TABLE} '
+        f'ON CONFLICT (name, measurement_unit) DO NOTHING'
+    )
+    return cursor.rowcount
+
+
+def import_ingredients(rows, batch_size):
+    """
+    Inserts ingredients missing from the catalogue batch by batch.
+
+    Rows are upserted on (name, measurement_unit), so importing the same
+    file again adds nothing. On PostgreSQL batches are loaded with COPY
+    into a temporary staging table. Yields (rows read, rows inserted)
+    after every batch.
+    """
+    if connection.vendor != 'postgresql':
+        for batch in batched(rows, batch_size):
+            yield len(batch), insert_batch(batch)
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE {STAGING_TABLE} '
+            f'(name varchar(256), measurement_unit varchar(20))'
+        )
+        try:
+            for batch in batched(rows, batch_size):
+                yield len(batch), copy_batch(cursor, batch)
+        finally:
+            cursor.execute(f'DROP TABLE {STAGING_TABLE}')
@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from recipes.models import IngredientsInRecipe, Recipe
+
+RECIPES_FILE = 'recipes.ndjson'
+IMAGES_DIR = 'images'
+
+
+def export_recipe(recipe, directory):
+    """Recipe as a JSON-serializable dict, its image copied to directory."""
+    image = None
+    if recipe.image:
+        image = f'{IMAGES_DIR}/{os.path.basename(recipe.image.name)}'
+        path = os.path.join(directory, image)
+        if not os.path.exists(path):
+            with default_storage.open(recipe.image.name) as source, open(
+                    path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+    return {
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'pub_date': recipe.pub_date.isoformat(),
+        'author': recipe.author.username,
+        'image': image,
+        'tags': [tag.slug for tag in recipe.tags.all()],
+        'ingredients': [
+            {
+                'name': item.ingredients.name,
+                'measurement_unit': item.ingredients.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in recipe.ingredients_for_recipe.all()
+        ],
+    }
+
+
+class Command(BaseCommand):
+    """
+    Command 'exportrecipes' writes recipes to an NDJSON file with their
+    images stored alongside, in the format read by 'importrecipes'.
+    """
+
+    help = 'Exports recipes to a directory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory to export to.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Recipes loaded per query.')
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        os.makedirs(os.path.join(directory, IMAGES_DIR), exist_ok=True)
+        recipes = Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch('ingredients_for_recipe',
+                     queryset=IngredientsInRecipe.objects.select_related(
+                         'ingredients'))
+        ).order_by('id')
+        ids = list(Recipe.objects.order_by('id').values_list('id', flat=True))
+        size = options['chunk_size']
+        with open(os.path.join(directory, RECIPES_FILE), 'w',
+                  encoding='utf-8') as file:
+            for start in range(0, len(ids), size):
+                for recipe in recipes.filter(id__in=ids[start:start + size]):
+                    file.write(json.dumps(export_recipe(recipe, directory),
+                                          ensure_ascii=False) + '\n')
+                print(f'{min(start + size, len(ids))} of {len(ids)} '
+                      f'recipes exported')
+        print(f'Recipes successfully exported to {directory}')
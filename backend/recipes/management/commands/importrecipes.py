@@ -0,0 +1,226 @@
+import json
+import os
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from multiprocessing import get_context
+from uuid import uuid4
+
+import django
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.cache import invalidate_recipe_feed, invalidate_reference
+from api.utils import insert_ignore
+from recipes.models import Ingredient, IngredientsInRecipe, Recipe, Tag
+from recipes.search import update_search_vectors
+from users.models import User
+
+from .exportrecipes import IMAGES_DIR, RECIPES_FILE
+
+INSERT_BATCH_SIZE = 100
+id_maps = {}
+
+
+def get_maps():
+    """Id maps of tags, authors and ingredients, loaded once per worker."""
+    if not id_maps:
+        id_maps['tags'] = dict(Tag.objects.values_list('slug', 'id'))
+        id_maps['authors'] = dict(User.objects.values_list('username', 'id'))
+        id_maps['ingredients'] = {
+            (name, measurement_unit): ingredient_id
+            for ingredient_id, name, measurement_unit
+            in Ingredient.objects.values_list('id', 'name',
+                                              'measurement_unit')
+        }
+    return id_maps
+
+
+def resolve_ingredients(items):
+    """Creates ingredients missing from the catalogue and maps them."""
+    ingredient_ids = get_maps()['ingredients']
+    missing = {
+        (ingredient['name'], ingredient['measurement_unit'])
+        for item in items for ingredient in item['ingredients']
+    } - ingredient_ids.keys()
+    if not missing:
+        return
+    Ingredient.objects.bulk_create(
+        (Ingredient(name=name, measurement_unit=measurement_unit)
+         for name, measurement_unit in missing),
+        ignore_conflicts=True
+    )
+    for ingredient_id, name, measurement_unit in Ingredient.objects.filter(
+            name__in={name for name, _ in missing}).values_list(
+            'id', 'name', 'measurement_unit'):
+        ingredient_ids[(name, measurement_unit)] = ingredient_id
+
+
+def build_recipe(item, author_id, pub_date, images):
+    """Unsaved recipe, its image is added to `images` to be copied."""
+    image = ''
+    if item['image']:
+        _, extension = os.path.splitext(item['image'])
+        image = f'recipes/images/{uuid4().hex}{extension}'
+        images[image] = item['image']
+    return Recipe(name=item['name'], text=item['text'],
+                  cooking_time=item['cooking_time'], pub_date=pub_date,
+                  author_id=author_id, image=image)
+
+
+def save_images(images, directory):
+    for name, path in images.items():
+        with open(os.path.join(directory, path), 'rb') as source:
+            default_storage.save(name, File(source))
+
+
+def import_chunk(lines, directory, author_id=None):
+    """
+    Imports a chunk of NDJSON lines in one transaction.
+
+    Recipes are matched on (author, name, pub_date), ones imported before
+    are skipped, so an interrupted import can simply be run again. Images
+    are copied once the transaction commits. Returns counts of imported,
+    existing and skipped recipes.
+    """
+    items = [json.loads(line) for line in lines if line.strip()]
+    resolve_ingredients(items)
+    maps = get_maps()
+    counts = Counter()
+    keyed = {}
+    for item in items:
+        recipe_author_id = author_id or maps['authors'].get(item['author'])
+        if recipe_author_id is None:
+            counts['skipped'] += 1
+            continue
+        pub_date = parse_datetime(item['pub_date']) if item.get(
+            'pub_date') else timezone.now()
+        keyed[(recipe_author_id, item['name'], pub_date)] = item
+    with transaction.atomic():
+        existing = set(Recipe.objects.filter(
+            author_id__in={key[0] for key in keyed},
+            pub_date__in={key[2] for key in keyed}
+        ).values_list('author_id', 'name', 'pub_date'))
+        counts['existing'] = len(keyed.keys() & existing)
+        keys = [key for key in keyed if key not in existing]
+        if not keys:
+            return counts
+        fields = [field for field in Recipe._meta.concrete_fields
+                  if not field.primary_key]
+        rows, images = [], {}
+        for key in keys:
+            recipe_author_id, _, pub_date = key
+            recipe = build_recipe(keyed[key], recipe_author_id, pub_date,
+                                  images)
+            rows.append({field.attname: getattr(recipe, field.attname)
+                         for field in fields})
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            insert_ignore(Recipe, rows[start:start + INSERT_BATCH_SIZE])
+        recipe_ids = {
+            (recipe_author_id, name, pub_date): recipe_id
+            for recipe_id, recipe_author_id, name, pub_date
+            in Recipe.objects.filter(
+                author_id__in={key[0] for key in keys},
+                pub_date__in={key[2] for key in keys}
+            ).values_list('id', 'author_id', 'name', 'pub_date')
+        }
+        ingredients, tags = [], []
+        for key in keys:
+            item, recipe_id = keyed[key], recipe_ids[key]
+            amounts = Counter()
+            for ingredient in item['ingredients']:
+                amounts[maps['ingredients'][(
+                    ingredient['name'], ingredient['measurement_unit']
+                )]] += ingredient['amount']
+            ingredients.extend(
+                IngredientsInRecipe(recipe_id=recipe_id,
+                                    ingredients_id=ingredient_id,
+                                    amount=amount)
+                for ingredient_id, amount in amounts.items()
+            )
+            tags.extend(
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for tag_id in {maps['tags'][slug] for slug in item['tags']
+                               if slug in maps['tags']}
+            )
+        IngredientsInRecipe.objects.bulk_create(ingredients)
+        Recipe.tags.through.objects.bulk_create(tags)
+        update_search_vectors([recipe_ids[key] for key in keys])
+        transaction.on_commit(lambda: save_images(images, directory))
+    counts['imported'] = len(keys)
+    return counts
+
+
+def read_chunks(file, size):
+    while True:
+        lines = list(islice(file, size))
+        if not lines:
+            return
+        yield lines
+
+
+class Command(BaseCommand):
+    """
+    Command 'importrecipes' loads recipes written by 'exportrecipes',
+    importing chunks of them in parallel in a process pool.
+    """
+
+    help = 'Imports recipes from a directory made by exportrecipes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory to import from.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of worker processes, one per CPU '
+                                 'on PostgreSQL. SQLite allows only one.')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Recipes imported per transaction.')
+        parser.add_argument('--author', default=None,
+                            help='Username to assign all recipes to, '
+                                 'authors are matched by username '
+                                 'by default.')
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        author_id = None
+        if options['author']:
+            author = User.objects.filter(username=options['author']).first()
+            if author is None:
+                raise CommandError(f'User {options["author"]} not found.')
+            author_id = author.id
+        workers = options['workers'] or (
+            os.cpu_count() if connection.vendor == 'postgresql' else 1)
+        if workers > 1 and connection.vendor == 'sqlite':
+            raise CommandError('SQLite allows one writer at a time, '
+                               'use --workers 1.')
+        if not os.path.isdir(os.path.join(directory, IMAGES_DIR)):
+            raise CommandError(f'{directory} is not an export directory.')
+        totals = Counter()
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=get_context('spawn'),
+                                 initializer=django.setup) as pool, open(
+                os.path.join(directory, RECIPES_FILE),
+                encoding='utf-8') as file:
+            pending = set()
+            for lines in read_chunks(file, options['chunk_size']):
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    self.collect(done, totals)
+                pending.add(pool.submit(import_chunk, lines, directory,
+                                        author_id))
+            self.collect(wait(pending).done, totals)
+        invalidate_reference('ingredients')
+        invalidate_recipe_feed()
+        print(f'Recipes successfully imported: {totals["imported"]} new, '
+              f'{totals["existing"]} already present, '
+              f'{totals["skipped"]} without a known author')
+
+    def collect(self, futures, totals):
+        for future in futures:
+            totals.update(future.result())
+        print(f'{sum(totals.values())} recipes processed, '
+              f'{totals["imported"]} imported')
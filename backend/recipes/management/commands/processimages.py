@@ -0,0 +1,100 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import django
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.images import process_image
+from recipes.models import (IMAGE_FAILED, IMAGE_PENDING, IMAGE_PROCESSING,
+                            IMAGE_READY, Recipe)
+
+
+def claim_batch(size):
+    with transaction.atomic():
+        recipes = list(Recipe.objects.select_for_update(
+            skip_locked=True
+        ).filter(image_status=IMAGE_PENDING).only('id', 'image')[:size])
+        Recipe.objects.filter(id__in=[recipe.id for recipe in recipes]).update(
+            image_status=IMAGE_PROCESSING)
+    return recipes
+
+
+def variant_paths(variants):
+    return [path for formats in variants.values() for path in formats.values()]
+
+
+@transaction.atomic
+def finish(recipe, original, variants):
+    """Stores processed images unless the recipe got a new image meanwhile."""
+    source = recipe.image.name
+    current = Recipe.objects.select_for_update().filter(
+        id=recipe.id, image=source).first()
+    if current is None:
+        for path in [original] + variant_paths(variants):
+            default_storage.delete(path)
+        return
+    stale = variant_paths(current.image_variants)
+    current.image.name = original
+    current.image_variants = variants
+    current.image_status = IMAGE_READY
+    current.save(update_fields=('image', 'image_variants', 'image_status'))
+    if source != original:
+        stale.append(source)
+    for path in stale:
+        transaction.on_commit(lambda path=path: default_storage.delete(path))
+
+
+class Command(BaseCommand):
+    """
+    Command 'processimages' validates uploaded recipe images, strips their
+    metadata and renders resized WebP and JPEG variants in a process pool.
+    """
+
+    help = 'Processes uploaded recipe images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of worker processes.')
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--sleep', type=float, default=2,
+                            help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty.')
+        parser.add_argument('--requeue', action='store_true',
+                            help='Requeue images left in processing.')
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            Recipe.objects.filter(image_status=IMAGE_PROCESSING).update(
+                image_status=IMAGE_PENDING)
+        with ProcessPoolExecutor(max_workers=options['workers'],
+                                 mp_context=get_context('spawn'),
+                                 initializer=django.setup) as pool:
+            while True:
+                recipes = claim_batch(options['batch_size'])
+                if not recipes:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+                futures = {
+                    pool.submit(process_image, recipe.image.name): recipe
+                    for recipe in recipes
+                }
+                for future in as_completed(futures):
+                    self.complete(futures[future], future)
+
+    def complete(self, recipe, future):
+        try:
+            original, variants = future.result()
+        except Exception as error:
+            Recipe.objects.filter(
+                id=recipe.id, image=recipe.image.name
+            ).update(image_status=IMAGE_FAILED)
+            print(f'Recipe {recipe.id}: image processing failed: {error}')
+            return
+        finish(recipe, original, variants)
+        print(f'Recipe {recipe.id}: image processed')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.shopping_list import find_mismatches, rebuild
+
+
+class Command(BaseCommand):
+    """
+    Command 'rebuildshoppinglist' recomputes precomputed shopping lists.
+    """
+
+    help = 'Rebuilds shopping lists and checks them against the carts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only compare stored shopping lists with the carts.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            print('Rebuilding shopping lists')
+            rebuild()
+        mismatches = find_mismatches()
+        for (user_id, ingredient_id), (stored, live) in mismatches.items():
+            print(f'User {user_id}, ingredient {ingredient_id}: '
+                  f'stored {stored}, expected {live}')
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} shopping list items differ')
+        print('Shopping lists match the carts')
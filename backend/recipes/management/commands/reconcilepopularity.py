@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import invalidate_popularity
+from recipes.popularity import find_mismatches, reconcile
+
+
+class Command(BaseCommand):
+    """
+    Command 'reconcilepopularity' corrects drifted popularity counters.
+    """
+
+    help = 'Recounts favorites and shopping carts of recipes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report counters that differ from the links.'
+        )
+
+    def handle(self, *args, **options):
+        mismatches = find_mismatches()
+        for (recipe_id, field), (stored, live) in mismatches.items():
+            print(f'Recipe {recipe_id}, {field}: '
+                  f'stored {stored}, expected {live}')
+        if options['check']:
+            print(f'{len(mismatches)} counters differ')
+            return
+        updated = reconcile()
+        if updated:
+            invalidate_popularity()
+        print(f'Updated {updated} recipes')
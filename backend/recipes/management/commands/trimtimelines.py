@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes.timeline import trim_all
+
+
+class Command(BaseCommand):
+    """
+    Command 'trimtimelines' bounds subscription timelines, which are
+    trimmed on every push, e.g. after TIMELINE_MAX_SIZE is lowered.
+    """
+
+    help = 'Drops timeline entries beyond TIMELINE_MAX_SIZE.'
+
+    def handle(self, *args, **options):
+        print(f'Deleted {trim_all()} timeline entries')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from recipes.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    """
+    Command 'updatesearchindex' recomputes search vectors of all recipes.
+    """
+
+    help = 'Recomputes recipe search vectors.'
+
+    def handle(self, *args, **options):
+        print('Updating recipe search vectors')
+        update_search_vectors()
+        print('Search vectors successfully updated')
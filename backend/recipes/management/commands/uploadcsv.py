@@ -1,23 +1,52 @@
-import csv
+import os
+import time
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from recipes.models import Ingredient
+from api.cache import invalidate_reference
+from recipes.importers import FORMATS, import_ingredients, read_ingredients
 
 
 class Command(BaseCommand):
     """
-    Command 'uploadcsv' uploads data from /data/ingredients.csv to Database.
+    Command 'uploadcsv' streams an ingredient catalogue into the database.
+
+    Accepts CSV, JSON and NDJSON files, ingredients already present are
+    skipped, so the command can be run again safely.
     """
 
-    help = 'Uploads data from ingredients.csv.'
+    help = 'Uploads ingredients from a CSV, JSON or NDJSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?',
+                            default='./data/ingredients.csv',
+                            help='Catalogue file, ./data/ingredients.csv '
+                                 'by default.')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='File format, guessed from the extension '
+                                 'by default.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows per insert batch.')
 
     def handle(self, *args, **options):
-        print('Loading ingredients data')
-        with open(r'./data/ingredients.csv', encoding='utf-8') as csv_file:
-            temp_data = [
-                Ingredient(name=line[0], measurement_unit=line[1])
-                for line in csv.reader(csv_file)
-            ]
-            Ingredient.objects.bulk_create(temp_data)
-        print('Data successfully uploaded to database')
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(
+            path)[1].lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError(f'Unknown format of {path}, use --format.')
+        print(f'Loading ingredients from {path}')
+        started = time.monotonic()
+        read = inserted = 0
+        with open(path, encoding='utf-8') as file:
+            for batch_read, batch_inserted in import_ingredients(
+                    read_ingredients(file, file_format),
+                    options['batch_size']):
+                read += batch_read
+                inserted += batch_inserted
+                elapsed = time.monotonic() - started
+                print(f'{read} rows read, {inserted} added, '
+                      f'{read / elapsed:.0f} rows/s')
+        invalidate_reference('ingredients')
+        print(f'Data successfully uploaded to database: {inserted} of '
+              f'{read} ingredients added in '
+              f'{time.monotonic() - started:.1f} s')
@@ -0,0 +1,181 @@
+import threading
+
+import numpy as np
+from django.db import transaction
+
+from .models import IngredientsInRecipe
+from .utils import LazyIndex
+
+
+class IngredientMatchIndex:
+    """
+    Inverted index from ingredients to the recipes that use them.
+
+    Recipes are addressed by their position in `recipe_ids`, postings are
+    sorted int32 arrays of positions, so scoring a set of ingredients is a
+    single bincount over the concatenated postings. Changes are applied
+    in place under the index lock, which match() holds as well. They only
+    replace the postings of the changed ingredients, `recipe_ids` and
+    `sizes` grow by doubling and positions of removed recipes are left
+    empty.
+    """
+
+    def __init__(self, rows):
+        recipe_ids, self.positions = [], {}
+        postings, self.ingredients = {}, {}
+        for recipe_id, ingredient_id in rows:
+            position = self.positions.get(recipe_id)
+            if position is None:
+                position = self.positions[recipe_id] = len(recipe_ids)
+                recipe_ids.append(recipe_id)
+                self.ingredients[recipe_id] = []
+            self.ingredients[recipe_id].append(ingredient_id)
+            postings.setdefault(ingredient_id, []).append(position)
+        self.count = len(recipe_ids)
+        self.recipe_ids = np.array(recipe_ids, dtype=np.int64)
+        self.postings = {
+            ingredient_id: np.array(recipes, dtype=np.int32)
+            for ingredient_id, recipes in postings.items()
+        }
+        self.sizes = np.bincount(
+            np.concatenate(list(self.postings.values()))
+            if self.postings else np.array([], dtype=np.int32),
+            minlength=len(recipe_ids)
+        )
+        self.lock = threading.Lock()
+
+    def match(self, ingredient_ids, limit):
+        """
+        Top recipes as (recipe_id, coverage, missing) tuples.
+
+        Recipes are ranked by the share of their ingredients in
+        `ingredient_ids`, then by the number of missing ones.
+        """
+        with self.lock:
+            matched = [self.postings[ingredient_id]
+                       for ingredient_id in set(ingredient_ids)
+                       if ingredient_id in self.postings]
+            if not matched or limit <= 0:
+                return []
+            counts = np.bincount(np.concatenate(matched),
+                                 minlength=len(self.sizes))
+            candidates = np.flatnonzero(counts)
+            sizes = self.sizes[candidates]
+            recipe_ids = self.recipe_ids[candidates]
+        coverage = counts[candidates] / sizes
+        missing = sizes - counts[candidates]
+        if len(candidates) > limit:
+            top = np.argpartition(-coverage, limit - 1)[:limit]
+            threshold = coverage[top].min()
+            top = np.flatnonzero(coverage >= threshold)
+            recipe_ids, coverage, missing = (
+                recipe_ids[top], coverage[top], missing[top])
+        order = np.lexsort((recipe_ids, missing, -coverage))[:limit]
+        return [
+            (int(recipe_ids[i]), float(coverage[i]), int(missing[i]))
+            for i in order
+        ]
+
+    def get_position(self, recipe_id):
+        """Position of the recipe, a new one at the end if needed."""
+        position = self.positions.get(recipe_id)
+        if position is not None:
+            return position
+        position = self.positions[recipe_id] = self.count
+        if position == len(self.recipe_ids):
+            capacity = max(2 * position, 16)
+            recipe_ids = np.zeros(capacity, dtype=np.int64)
+            recipe_ids[:position] = self.recipe_ids
+            sizes = np.zeros(capacity, dtype=self.sizes.dtype)
+            sizes[:position] = self.sizes
+            self.recipe_ids, self.sizes = recipe_ids, sizes
+        self.recipe_ids[position] = recipe_id
+        self.count += 1
+        return position
+
+    def set_recipe(self, recipe_id, ingredient_ids):
+        """Sets ingredients of the recipe, returns the index."""
+        ingredient_ids = list(dict.fromkeys(ingredient_ids))
+        with self.lock:
+            self._remove_recipe(recipe_id)
+            if not ingredient_ids:
+                return self
+            position = self.get_position(recipe_id)
+            for ingredient_id in ingredient_ids:
+                posting = self.postings.get(ingredient_id,
+                                            np.array([], dtype=np.int32))
+                self.postings[ingredient_id] = np.insert(
+                    posting, np.searchsorted(posting, position), position)
+            self.sizes[position] = len(ingredient_ids)
+            self.ingredients[recipe_id] = ingredient_ids
+        return self
+
+    def remove_recipe(self, recipe_id):
+        """Removes the recipe, returns the index."""
+        with self.lock:
+            self._remove_recipe(recipe_id)
+        return self
+
+    def _remove_recipe(self, recipe_id):
+        ingredient_ids = self.ingredients.pop(recipe_id, ())
+        if not ingredient_ids:
+            return
+        position = self.positions[recipe_id]
+        for ingredient_id in ingredient_ids:
+            posting = self.postings[ingredient_id]
+            posting = posting[posting != position]
+            if len(posting):
+                self.postings[ingredient_id] = posting
+            else:
+                del self.postings[ingredient_id]
+        self.sizes[position] = 0
+
+    def remove_ingredient(self, ingredient_id):
+        """Removes the ingredient from all recipes, returns the index."""
+        with self.lock:
+            posting = self.postings.pop(ingredient_id, None)
+            if posting is None:
+                return self
+            self.sizes[posting] -= 1
+            for recipe_id in self.recipe_ids[posting].tolist():
+                self.ingredients[recipe_id] = [
+                    other for other in self.ingredients[recipe_id]
+                    if other != ingredient_id
+                ]
+        return self
+
+
+def build_match_index():
+    return IngredientMatchIndex(IngredientsInRecipe.objects.values_list(
+        'recipe_id', 'ingredients_id').order_by('recipe_id').iterator())
+
+
+ingredient_match_index = LazyIndex(build_match_index, 'RECIPE_MATCH_TTL')
+
+
+def update_recipe_matches(recipe_id, ingredient_ids):
+    """Sets ingredients of the recipe in the index once committed."""
+    ingredient_ids = list(ingredient_ids)
+    transaction.on_commit(lambda: ingredient_match_index.update(
+        lambda index: index.set_recipe(recipe_id, ingredient_ids)))
+
+
+def refresh_recipe_matches(recipe_id):
+    """Reloads ingredients of the recipe into the index once committed."""
+    def refresh():
+        ingredient_ids = list(IngredientsInRecipe.objects.filter(
+            recipe_id=recipe_id).values_list('ingredients_id', flat=True))
+        ingredient_match_index.update(
+            lambda index: index.set_recipe(recipe_id, ingredient_ids))
+
+    transaction.on_commit(refresh)
+
+
+def remove_recipe_matches(recipe_id):
+    transaction.on_commit(lambda: ingredient_match_index.update(
+        lambda index: index.remove_recipe(recipe_id)))
+
+
+def remove_ingredient_matches(ingredient_id):
+    transaction.on_commit(lambda: ingredient_match_index.update(
+        lambda index: index.remove_ingredient(ingredient_id)))
@@ -0,0 +1,31 @@
+from django.db import migrations
+from django.db.models import Sum
+
+
+def fill_shopping_lists(apps, schema_editor):
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    totals = ShoppingCart.objects.filter(
+        purchase__ingredients_for_recipe__isnull=False
+    ).values_list(
+        'customer_id', 'purchase__ingredients_for_recipe__ingredients_id'
+    ).annotate(
+        total_amount=Sum('purchase__ingredients_for_recipe__amount')
+    ).order_by()
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                          total_amount=total_amount)
+         for user_id, ingredient_id, total_amount in totals),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
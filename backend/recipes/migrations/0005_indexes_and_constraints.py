@@ -0,0 +1,82 @@
+# Generated by Django 3.2 on 2026-10-17 22:25
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+from django.db.models import Min, Sum
+
+from recipes.operations import AddPostgresIndex
+
+
+def remove_duplicates(model, fields):
+    keep = model.objects.values(*fields).annotate(
+        keep_id=Min('id')).values_list('keep_id', flat=True).order_by()
+    model.objects.exclude(id__in=list(keep)).delete()
+
+
+def deduplicate(apps, schema_editor):
+    remove_duplicates(apps.get_model('recipes', 'Favorite'),
+                      ('owner', 'favorite'))
+    remove_duplicates(apps.get_model('recipes', 'ShoppingCart'),
+                      ('customer', 'purchase'))
+    IngredientsInRecipe = apps.get_model('recipes', 'IngredientsInRecipe')
+    for row in IngredientsInRecipe.objects.values(
+        'recipe', 'ingredients'
+    ).annotate(
+        keep_id=Min('id'), total_amount=Sum('amount'), rows=models.Count('id')
+    ).filter(rows__gt=1).order_by():
+        IngredientsInRecipe.objects.filter(id=row['keep_id']).update(
+            amount=row['total_amount'])
+    remove_duplicates(IngredientsInRecipe, ('recipe', 'ingredients'))
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    ShoppingListItem.objects.all().delete()
+    totals = ShoppingCart.objects.filter(
+        purchase__ingredients_for_recipe__isnull=False
+    ).values_list(
+        'customer_id', 'purchase__ingredients_for_recipe__ingredients_id'
+    ).annotate(
+        total_amount=Sum('purchase__ingredients_for_recipe__amount')
+    ).order_by()
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                          total_amount=total_amount)
+         for user_id, ingredient_id, total_amount in totals),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_fill_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        TrigramExtension(),
+        AddPostgresIndex(
+            model_name='ingredient',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='ingredient_name_trgm', opclasses=('gin_trgm_ops',)),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['pub_date', 'id'], name='recipe_pub_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', 'pub_date'], name='recipe_author_pub_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('owner', 'favorite'), name='unique_favorite'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientsinrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredients'), name='unique_ingredient_in_recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('customer', 'purchase'), name='unique_shopping_cart'),
+        ),
+    ]
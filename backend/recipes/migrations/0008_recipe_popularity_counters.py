@@ -0,0 +1,45 @@
+# Generated by Django 3.2 on 2026-10-17 22:36
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+
+    def count(model, recipe_field):
+        return Coalesce(Subquery(model.objects.filter(
+            **{recipe_field: OuterRef('pk')}
+        ).values(recipe_field).annotate(count=Count('id')).values('count')),
+            Value(0))
+
+    Recipe.objects.update(favorites_count=count(Favorite, 'favorite'),
+                          in_carts_count=count(ShoppingCart, 'purchase'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Favorites count'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='In shopping carts count'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['favorites_count', 'in_carts_count', 'id'], name='recipe_popular'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2 on 2026-10-17 22:39
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_rows(model, ingredient_field, owner_field, amount_field, keep_id,
+               duplicate_ids):
+    kept = {
+        getattr(row, owner_field): row
+        for row in model.objects.filter(**{ingredient_field: keep_id})
+    }
+    for row in model.objects.filter(
+            **{f'{ingredient_field}__in': duplicate_ids}):
+        target = kept.get(getattr(row, owner_field))
+        if target is None:
+            setattr(row, ingredient_field, keep_id)
+            row.save()
+            kept[getattr(row, owner_field)] = row
+        else:
+            setattr(target, amount_field,
+                    getattr(target, amount_field)
+                    + getattr(row, amount_field))
+            target.save()
+            row.delete()
+
+
+def deduplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientsInRecipe = apps.get_model('recipes', 'IngredientsInRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    for row in Ingredient.objects.values('name', 'measurement_unit').annotate(
+        keep_id=Min('id'), rows=Count('id')
+    ).filter(rows__gt=1).order_by():
+        duplicate_ids = list(Ingredient.objects.filter(
+            name=row['name'], measurement_unit=row['measurement_unit']
+        ).exclude(id=row['keep_id']).values_list('id', flat=True))
+        merge_rows(IngredientsInRecipe, 'ingredients_id', 'recipe_id',
+                   'amount', row['keep_id'], duplicate_ids)
+        merge_rows(ShoppingListItem, 'ingredient_id', 'user_id',
+                   'total_amount', row['keep_id'], duplicate_ids)
+        Ingredient.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_timeline'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_ingredients,
+                             migrations.RunPython.noop),
+    ]
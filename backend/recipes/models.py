@@ -1,8 +1,21 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import RegexValidator
 from django.db import models
 
 from users.models import User
 
+IMAGE_PENDING = 'pending'
+IMAGE_PROCESSING = 'processing'
+IMAGE_READY = 'ready'
+IMAGE_FAILED = 'failed'
+IMAGE_STATUS_CHOICES = (
+    (IMAGE_PENDING, 'pending'),
+    (IMAGE_PROCESSING, 'processing'),
+    (IMAGE_READY, 'ready'),
+    (IMAGE_FAILED, 'failed'),
+)
+
 
 class Ingredient(models.Model):
     """Ingredients for recipes model."""
@@ -13,6 +26,19 @@ class Ingredient(models.Model):
         verbose_name = 'Ingredient'
         verbose_name_plural = 'Ingredients'
         ordering = ('name',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient'
+            )
+        ]
+        indexes = [
+            GinIndex(
+                fields=('name',),
+                name='ingredient_name_trgm',
+                opclasses=('gin_trgm_ops',)
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -47,6 +73,15 @@ class Recipe(models.Model):
     text = models.TextField('Description')
     cooking_time = models.PositiveSmallIntegerField('Cooking time')
     image = models.ImageField('Image', upload_to='recipes/images')
+    image_status = models.CharField(
+        'Image status',
+        max_length=20,
+        choices=IMAGE_STATUS_CHOICES,
+        default=IMAGE_PENDING,
+        db_index=True
+    )
+    image_variants = models.JSONField('Image variants', default=dict,
+                                      blank=True)
     author = models.ForeignKey(User,
                                verbose_name='Author',
                                on_delete=models.CASCADE,
@@ -66,11 +101,31 @@ class Recipe(models.Model):
     )
     pub_date = models.DateTimeField('Publication date',
                                     auto_now_add=True)
+    search_vector = SearchVectorField('Search vector', null=True,
+                                      editable=False)
+    favorites_count = models.PositiveIntegerField('Favorites count',
+                                                  default=0, editable=False)
+    in_carts_count = models.PositiveIntegerField('In shopping carts count',
+                                                 default=0, editable=False)
+    fanned_out = models.BooleanField('Pushed to timelines', default=False,
+                                     editable=False)
 
     class Meta:
         verbose_name = 'Recipe'
         verbose_name_plural = 'Recipes'
         ordering = ('pub_date',)
+        indexes = [
+            models.Index(fields=('pub_date', 'id'),
+                         name='recipe_pub_date_id'),
+            models.Index(fields=('author', 'pub_date'),
+                         name='recipe_author_pub_date'),
+            GinIndex(fields=('search_vector',), name='recipe_search_vector'),
+            models.Index(fields=('favorites_count', 'in_carts_count', 'id'),
+                         name='recipe_popular'),
+            models.Index(fields=('author', 'pub_date'),
+                         condition=models.Q(fanned_out=False),
+                         name='recipe_fan_out_on_read'),
+        ]
 
     def __str__(self):
         return self.name
@@ -92,6 +147,12 @@ class IngredientsInRecipe(models.Model):
 
     class Meta:
         verbose_name = 'Ingredients in recipe'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('recipe', 'ingredients'),
+                name='unique_ingredient_in_recipe'
+            )
+        ]
 
     def __str__(self):
         return str(self.id)
@@ -112,6 +173,12 @@ class Favorite(models.Model):
 
     class Meta:
         verbose_name = 'Favorite'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('owner', 'favorite'),
+                name='unique_favorite'
+            )
+        ]
 
     def __str__(self):
         return str(self.id)
@@ -132,6 +199,79 @@ class ShoppingCart(models.Model):
 
     class Meta:
         verbose_name = 'Shopping Cart'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('customer', 'purchase'),
+                name='unique_shopping_cart'
+            )
+        ]
+
+    def __str__(self):
+        return str(self.id)
+
+
+class ShoppingListItem(models.Model):
+    """Precomputed ingredient totals of user's shopping cart."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items'
+    )
+    total_amount = models.PositiveIntegerField('Total amount', default=0)
+
+    class Meta:
+        verbose_name = 'Shopping list item'
+        verbose_name_plural = 'Shopping list items'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return str(self.id)
+
+
+class TimelineEntry(models.Model):
+    """Recipe pushed to the timeline of one of the author's subscribers."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    pub_date = models.DateTimeField('Publication date')
+
+    class Meta:
+        verbose_name = 'Timeline entry'
+        verbose_name_plural = 'Timeline entries'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(fields=('user', 'pub_date', 'recipe'),
+                         name='timeline_user_pub_date'),
+            models.Index(fields=('user', 'author'),
+                         name='timeline_user_author'),
+        ]
 
     def __str__(self):
         return str(self.id)
@@ -0,0 +1,45 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Favorite, Recipe, ShoppingCart
+
+COUNTERS = {
+    Favorite: ('favorites_count', 'favorite'),
+    ShoppingCart: ('in_carts_count', 'purchase'),
+}
+
+
+def change_count(model, recipe_ids, delta):
+    """Adds delta to the counter of `model` links on the given recipes."""
+    field, _ = COUNTERS[model]
+    Recipe.objects.filter(id__in=recipe_ids).update(
+        **{field: Greatest(F(field) + delta, Value(0))})
+
+
+def get_live_count(model):
+    _, recipe_field = COUNTERS[model]
+    return Coalesce(Subquery(model.objects.filter(
+        **{recipe_field: OuterRef('pk')}
+    ).values(recipe_field).annotate(count=Count('id')).values('count')),
+        Value(0))
+
+
+def find_mismatches():
+    """Recipes whose stored counters differ from the links."""
+    mismatches = {}
+    for model, (field, _) in COUNTERS.items():
+        for recipe_id, stored, live in Recipe.objects.annotate(
+                live=get_live_count(model)).exclude(
+                **{field: F('live')}).values_list('id', field, 'live'):
+            mismatches[(recipe_id, field)] = (stored, live)
+    return mismatches
+
+
+def reconcile():
+    """Corrects drifted counters, returns the number of updated rows."""
+    updated = 0
+    for model, (field, _) in COUNTERS.items():
+        live = get_live_count(model)
+        updated += Recipe.objects.exclude(**{field: live}).update(
+            **{field: live})
+    return updated
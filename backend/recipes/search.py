@@ -0,0 +1,194 @@
+import heapq
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .models import IngredientsInRecipe, Recipe
+from .utils import LazyIndex
+
+TOKEN = re.compile(r'\w+')
+FIELD_WEIGHTS = {'name': 3, 'ingredients': 2, 'text': 1}
+UPPER_BOUND = '\uffff'
+SEARCH_CHUNK_LIMIT = 10000
+
+
+def uses_search_vector():
+    return connection.vendor == 'postgresql'
+
+
+def tokenize(value):
+    return TOKEN.findall(value.casefold().replace('ё', 'е'))
+
+
+def get_search_vector(config):
+    """Weighted vector over name, text and ingredient names of a recipe."""
+    ingredient_names = IngredientsInRecipe.objects.filter(
+        recipe=OuterRef('pk')
+    ).values('recipe').annotate(
+        names=StringAgg('ingredients__name', ' ')
+    ).values('names')
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector(Coalesce(Subquery(ingredient_names), Value('')),
+                       weight='B', config=config)
+        + SearchVector('text', weight='C', config=config)
+    )
+
+
+def update_search_vectors(recipe_ids=None):
+    """Refreshes stored search vectors, all of them by default."""
+    if not uses_search_vector():
+        recipe_search_index.invalidate()
+        return
+    recipes = Recipe.objects.all()
+    if recipe_ids is not None:
+        recipes = recipes.filter(id__in=recipe_ids)
+    recipes.update(search_vector=get_search_vector(settings.SEARCH_CONFIG))
+
+
+class RecipeSearchIndex:
+    """
+    In-process inverted index used where full-text search isn't available.
+
+    Query terms match tokens by prefix, every term has to match and
+    recipes are ranked by the summed field weights of their matches.
+    """
+
+    def __init__(self):
+        self.index = LazyIndex(self.build, 'SEARCH_INDEX_TTL')
+
+    def invalidate(self):
+        self.index.invalidate()
+
+    def build(self):
+        postings = defaultdict(lambda: defaultdict(int))
+        for recipe_id, name, text in Recipe.objects.values_list(
+                'id', 'name', 'text').iterator():
+            for token in tokenize(name):
+                postings[token][recipe_id] += FIELD_WEIGHTS['name']
+            for token in tokenize(text):
+                postings[token][recipe_id] += FIELD_WEIGHTS['text']
+        for recipe_id, name in IngredientsInRecipe.objects.values_list(
+                'recipe_id', 'ingredients__name').iterator():
+            for token in tokenize(name):
+                postings[token][recipe_id] += FIELD_WEIGHTS['ingredients']
+        postings = {token: dict(scores) for token, scores in postings.items()}
+        return postings, sorted(postings)
+
+    def get_scores(self, query):
+        """Relevance of the recipes matching every term, by id."""
+        terms = tokenize(query)
+        if not terms:
+            return {}
+        postings, tokens = self.index.get()
+        scores = None
+        for term in terms:
+            start = bisect_left(tokens, term)
+            end = bisect_left(tokens, term + UPPER_BOUND)
+            if end - start == 1:
+                term_scores = postings[tokens[start]]
+            else:
+                term_scores = defaultdict(int)
+                for token in tokens[start:end]:
+                    for recipe_id, score in postings[token].items():
+                        term_scores[recipe_id] += score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {recipe_id: score + term_scores[recipe_id]
+                          for recipe_id, score in scores.items()
+                          if recipe_id in term_scores}
+            if not scores:
+                return {}
+        return scores
+
+    def ranked(self, query):
+        """Matching recipe ids ordered by descending relevance."""
+        scores = self.get_scores(query)
+        recipe_ids = np.fromiter(scores.keys(), dtype=np.int64,
+                                 count=len(scores))
+        values = np.fromiter(scores.values(), dtype=np.int64,
+                             count=len(scores))
+        return recipe_ids[np.lexsort((recipe_ids, -values))].tolist()
+
+    def search(self, query, limit):
+        """Top `limit` recipe ids ordered by descending relevance."""
+        return self.ranked(query)[:limit]
+
+
+recipe_search_index = RecipeSearchIndex()
+
+
+def get_matching_ids(queryset, query):
+    """
+    The SEARCH_INDEX_LIMIT best matches among the recipes of the queryset.
+
+    Up to SEARCH_CHUNK_LIMIT recipes of the queryset are scored directly.
+    Ranked ids are checked against larger querysets in growing chunks, so
+    filters don't lose matches ranked below the global top.
+    """
+    limit = settings.SEARCH_INDEX_LIMIT
+    candidates = list(queryset.order_by().values_list(
+        'id', flat=True)[:SEARCH_CHUNK_LIMIT + 1])
+    if len(candidates) <= SEARCH_CHUNK_LIMIT:
+        scores = recipe_search_index.get_scores(query)
+        return heapq.nsmallest(
+            limit, (recipe_id for recipe_id in candidates
+                    if recipe_id in scores),
+            key=lambda recipe_id: (-scores[recipe_id], recipe_id))
+    ranked = iter(recipe_search_index.ranked(query))
+    recipe_ids = []
+    chunk_size = min(limit, SEARCH_CHUNK_LIMIT)
+    while len(recipe_ids) < limit:
+        chunk = list(islice(ranked, chunk_size))
+        if not chunk:
+            break
+        found = set(queryset.filter(id__in=chunk).values_list('id',
+                                                              flat=True))
+        recipe_ids.extend(recipe_id for recipe_id in chunk
+                          if recipe_id in found)
+        chunk_size = min(chunk_size * 2, SEARCH_CHUNK_LIMIT)
+    return recipe_ids[:limit]
+
+
+def search_recipes(queryset, query):
+    """
+    Filters the queryset by a search query and orders it by rank.
+
+    Without full-text search only the SEARCH_INDEX_LIMIT best matches
+    of the queryset are returned, which bounds the ordering expression.
+    """
+    if uses_search_vector():
+        search_query = SearchQuery(query, config=settings.SEARCH_CONFIG,
+                                   search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', 'pub_date', 'id')
+    if queryset.query.has_filters():
+        recipe_ids = get_matching_ids(queryset, query)
+    else:
+        recipe_ids = recipe_search_index.search(query,
+                                                settings.SEARCH_INDEX_LIMIT)
+    if not recipe_ids:
+        return queryset.none()
+    column = '{}.{}'.format(connection.ops.quote_name(Recipe._meta.db_table),
+                            connection.ops.quote_name('id'))
+    # A simple CASE compiles much faster than When(id=...) conditions.
+    position = RawSQL(
+        'CASE {} {} END'.format(
+            column, ' '.join(['WHEN %s THEN %s'] * len(recipe_ids))),
+        [value for position, recipe_id in enumerate(recipe_ids)
+         for value in (recipe_id, position)],
+        output_field=IntegerField())
+    return queryset.filter(id__in=recipe_ids).order_by(position, 'id')
@@ -0,0 +1,151 @@
+from collections import Counter
+
+from django.db import connections, router, transaction
+from django.db.models import Sum
+
+from .models import IngredientsInRecipe, ShoppingCart, ShoppingListItem
+
+
+def get_recipes_amounts(recipes):
+    """Summed ingredient amounts of the recipes as {ingredient_id: amount}."""
+    return Counter(dict(IngredientsInRecipe.objects.filter(
+        recipe__in=recipes
+    ).values_list('ingredients_id').annotate(Sum('amount')).order_by()))
+
+
+def get_recipe_amounts(recipe):
+    return get_recipes_amounts([recipe])
+
+
+def add_items(rows):
+    """
+    Inserts (user_id, ingredient_id, amount) items in a single upsert.
+
+    An item created by a concurrent transaction in the meantime gets the
+    amount added to its total instead of failing the unique constraint.
+    """
+    if not rows:
+        return
+    connection = connections[router.db_for_write(ShoppingListItem)]
+    quote_name = connection.ops.quote_name
+    table = quote_name(ShoppingListItem._meta.db_table)
+    sql = (
+        'INSERT INTO {table} (user_id, ingredient_id, total_amount) '
+        'VALUES {values} ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+        'SET total_amount = {table}.total_amount + EXCLUDED.total_amount'
+    ).format(table=table, values=', '.join(['(%s, %s, %s)'] * len(rows)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+def apply_deltas(user_ids, deltas):
+    """
+    Adds ingredient amount deltas to shopping lists of the given users.
+
+    A user listed several times gets the deltas applied as many times,
+    items that drop to zero are removed. Existing items are locked, new
+    ones are upserted so concurrent first additions add up.
+    """
+    deltas = {key: value for key, value in deltas.items() if value}
+    if not user_ids or not deltas:
+        return
+    with transaction.atomic():
+        items = {
+            (item.user_id, item.ingredient_id): item
+            for item in ShoppingListItem.objects.select_for_update().filter(
+                user_id__in=set(user_ids), ingredient_id__in=deltas)
+        }
+        created = set()
+        for user_id in user_ids:
+            for ingredient_id, delta in deltas.items():
+                key = (user_id, ingredient_id)
+                if key not in items:
+                    items[key] = ShoppingListItem(user_id=user_id,
+                                                  ingredient_id=ingredient_id)
+                    created.add(key)
+                items[key].total_amount += delta
+        to_create, to_update, to_delete = [], [], []
+        for key, item in items.items():
+            if key in created:
+                if item.total_amount > 0:
+                    to_create.append((*key, item.total_amount))
+            elif item.total_amount > 0:
+                to_update.append(item)
+            else:
+                to_delete.append(item.id)
+        add_items(to_create)
+        ShoppingListItem.objects.bulk_update(to_update, ('total_amount',))
+        if to_delete:
+            ShoppingListItem.objects.filter(id__in=to_delete).delete()
+
+
+def add_recipes(user, recipes):
+    apply_deltas([user.id], get_recipes_amounts(recipes))
+
+
+def remove_recipes(user, recipes):
+    apply_deltas([user.id], {
+        ingredient_id: -amount
+        for ingredient_id, amount in get_recipes_amounts(recipes).items()
+    })
+
+
+def add_recipe(user, recipe):
+    add_recipes(user, [recipe])
+
+
+def remove_recipe(user, recipe):
+    remove_recipes(user, [recipe])
+
+
+def update_recipe(recipe, old_amounts, new_amounts):
+    """Moves carts holding the recipe from old to new ingredient amounts."""
+    deltas = Counter(new_amounts)
+    deltas.subtract(old_amounts)
+    if not any(deltas.values()):
+        return
+    user_ids = list(ShoppingCart.objects.filter(
+        purchase=recipe).values_list('customer_id', flat=True))
+    apply_deltas(user_ids, deltas)
+
+
+def get_live_totals():
+    """Shopping list totals of every user aggregated from their carts."""
+    return ShoppingCart.objects.filter(
+        purchase__ingredients_for_recipe__isnull=False
+    ).values_list(
+        'customer_id', 'purchase__ingredients_for_recipe__ingredients_id'
+    ).annotate(
+        total_amount=Sum('purchase__ingredients_for_recipe__amount')
+    ).order_by()
+
+
+def rebuild():
+    """Replaces the whole shopping list table with the live aggregate."""
+    with transaction.atomic():
+        ShoppingListItem.objects.all().delete()
+        ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                              total_amount=total_amount)
+             for user_id, ingredient_id, total_amount in get_live_totals()),
+            batch_size=1000
+        )
+
+
+def find_mismatches():
+    """Items whose stored total differs from the live aggregate."""
+    live = {
+        (user_id, ingredient_id): total_amount
+        for user_id, ingredient_id, total_amount in get_live_totals()
+    }
+    stored = {
+        (user_id, ingredient_id): total_amount
+        for user_id, ingredient_id, total_amount
+        in ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'total_amount')
+    }
+    return {
+        key: (stored.get(key, 0), live.get(key, 0))
+        for key in live.keys() | stored.keys()
+        if stored.get(key, 0) != live.get(key, 0)
+    }
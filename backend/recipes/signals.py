@@ -0,0 +1,47 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .autocomplete import ingredient_autocomplete
+from .matching import (refresh_recipe_matches, remove_ingredient_matches,
+                       remove_recipe_matches)
+from .models import Ingredient, IngredientsInRecipe, Recipe
+from .search import recipe_search_index, update_search_vectors
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_autocomplete(sender, instance, **kwargs):
+    ingredient_autocomplete.update(instance)
+
+
+@receiver(post_delete, sender=Ingredient)
+def remove_ingredient_autocomplete(sender, instance, **kwargs):
+    ingredient_autocomplete.remove(instance.id)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search_vectors(sender, instance, created, **kwargs):
+    if not created:
+        update_search_vectors(Recipe.objects.filter(
+            ingredients=instance).values('id'))
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_search(sender, **kwargs):
+    recipe_search_index.invalidate()
+
+
+# Deleted ingredient rows are handled through their recipe and ingredient,
+# a post_delete receiver on the rows would disable fast deletes of them.
+@receiver(post_save, sender=IngredientsInRecipe)
+def refresh_ingredient_match(sender, instance, **kwargs):
+    refresh_recipe_matches(instance.recipe_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_match(sender, instance, **kwargs):
+    remove_recipe_matches(instance.id)
+
+
+@receiver(post_delete, sender=Ingredient)
+def remove_ingredient_match(sender, instance, **kwargs):
+    remove_ingredient_matches(instance.id)
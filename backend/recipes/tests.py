@@ -0,0 +1,207 @@
+import json
+import threading
+from io import StringIO
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .autocomplete import (IngredientIndex, build_ingredient_index,
+                           ingredient_autocomplete)
+from .importers import decode_items, import_ingredients, read_ingredients
+from .models import Ingredient
+from .utils import LazyIndex
+
+
+class IngredientIndexTest(SimpleTestCase):
+    """Autocomplete ranking, normalization and deltas."""
+
+    rows = [
+        (1, 'Соль', 'г'),
+        (2, 'Соль морская', 'г'),
+        (3, 'Морская соль', 'г'),
+        (4, 'Фасоль', 'г'),
+        (5, 'Сахар', 'г'),
+        (6, 'Ёжевика', 'г'),
+        (7, 'Свёкла', 'г'),
+    ]
+
+    def search(self, index, query, limit=10):
+        return [ingredient['id'] for ingredient in index.search(query, limit)]
+
+    def test_ranking(self):
+        index = IngredientIndex(self.rows)
+        # Prefix, word start, then trigram matches by similarity.
+        self.assertEqual(self.search(index, 'соль'), [1, 2, 3, 4, 5, 7])
+        self.assertEqual(self.search(index, 'соль', 3), [1, 2, 3])
+
+    def test_case_and_yo_folding(self):
+        index = IngredientIndex(self.rows)
+        self.assertEqual(self.search(index, 'ЕЖ'), [6])
+        self.assertEqual(self.search(index, 'свек', 1), [7])
+        self.assertEqual(self.search(index, 'свёк', 1), [7])
+
+    def test_limit(self):
+        index = IngredientIndex(
+            [(pk, f'Перец {pk}', 'г') for pk in range(10)])
+        self.assertEqual(self.search(index, 'перец', 3), [0, 1, 2])
+        self.assertEqual(self.search(index, 'перец', 0), [])
+
+    def test_deltas(self):
+        index = IngredientIndex(self.rows[:4])
+        for pk, name, unit in self.rows[4:]:
+            index.add(pk, name, unit)
+        index.add(2, 'Перец', 'г')
+        index.remove(4)
+        rows = [(pk, 'Перец', unit) if pk == 2 else (pk, name, unit)
+                for pk, name, unit in self.rows if pk != 4]
+        rebuilt = IngredientIndex(rows)
+        for query in ('соль', 'пер', 'морс', 'ежевика', 'фасоль'):
+            with self.subTest(query=query):
+                self.assertEqual(index.search(query, 10),
+                                 rebuilt.search(query, 10))
+        self.assertEqual(len(index), len(rebuilt))
+
+
+class IngredientAutocompleteTest(TestCase):
+    """Ingredient changes reach the built index without a rebuild."""
+
+    def setUp(self):
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+        ingredient_autocomplete.invalidate()
+        ingredient_autocomplete.search('соль')
+
+    def search(self, query):
+        with self.assertNumQueries(0):
+            return [ingredient['name']
+                    for ingredient in ingredient_autocomplete.search(query)]
+
+    def test_changes_applied(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = Ingredient.objects.create(
+                name='Соль морская', measurement_unit='г')
+        self.assertEqual(self.search('соль'), ['Соль', 'Соль морская'])
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.name = 'Перец'
+            ingredient.save()
+        self.assertEqual(self.search('соль'), ['Соль'])
+        self.assertEqual(self.search('пер'), ['Перец'])
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.delete()
+        self.assertEqual(self.search('пер'), [])
+        self.assertEqual(
+            ingredient_autocomplete.search('соль'),
+            build_ingredient_index().search('соль', 20))
+
+    @override_settings(INGREDIENT_AUTOCOMPLETE_LIMIT=2)
+    def test_limit_setting(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Соль {number}', measurement_unit='г')
+            for number in range(5))
+        ingredient_autocomplete.invalidate()
+        self.assertEqual(len(ingredient_autocomplete.search('соль', 10)), 2)
+
+
+@override_settings(TEST_INDEX_TTL=0)
+class LazyIndexTest(SimpleTestCase):
+    """Stale indexes are rebuilt in the background."""
+
+    def setUp(self):
+        self.builds = 0
+        self.release = threading.Event()
+        self.release.set()
+        self.index = LazyIndex(self.build, 'TEST_INDEX_TTL')
+
+    def build(self):
+        self.release.wait(5)
+        self.builds += 1
+        return [self.builds]
+
+    def test_stale_index_served(self):
+        self.assertEqual(self.index.get(), [1])
+        self.release.clear()
+        self.assertEqual(self.index.get(), [1])
+        thread = self.index._thread
+        self.release.set()
+        thread.join(5)
+        self.assertEqual(self.index.get(), [2])
+
+    def test_changes_during_rebuild(self):
+        self.index.get()
+        self.release.clear()
+        thread = self.index.refresh()
+        self.assertIsNone(self.index.refresh())
+        self.index.update(lambda index: index + ['change'])
+        self.assertEqual(self.index.get(), [1, 'change'])
+        self.release.set()
+        thread.join(5)
+        self.assertEqual(self.index._index, [2, 'change'])
+
+    def test_invalidated_during_rebuild(self):
+        self.index.get()
+        self.release.clear()
+        thread = self.index.refresh()
+        self.index.invalidate()
+        self.release.set()
+        thread.join(5)
+        self.assertIsNone(self.index._index)
+
+
+class IngredientImportTest(TestCase):
+    """Catalogue files are streamed in every format and imported once."""
+
+    items = [
+        {'name': 'Соль', 'measurement_unit': 'г'},
+        {'name': ' Перец, "чёрный" [молотый] ', 'measurement_unit': 'г'},
+        {'name': 'Сахар {тростниковый}', 'measurement_unit': 'кг'},
+        {'name': '', 'measurement_unit': 'г'},
+        {'name': 'Масло\u2028сливочное', 'measurement_unit': 'г'},
+    ]
+    expected = [
+        ('Соль', 'г'),
+        ('Перец, "чёрный" [молотый]', 'г'),
+        ('Сахар {тростниковый}', 'кг'),
+        ('Масло\u2028сливочное', 'г'),
+    ]
+
+    def read(self, content, file_format):
+        return list(read_ingredients(StringIO(content), file_format))
+
+    def test_decode_items(self):
+        decoder = json.JSONDecoder()
+        buffer = ' {"a": 1}, {"b": "]"} ,{"c"'
+        items, position = decode_items(decoder, buffer, final=False)
+        self.assertEqual(items, [{'a': 1}, {'b': ']'}])
+        self.assertEqual(buffer[position:], '{"c"')
+        with self.assertRaises(json.JSONDecodeError):
+            decode_items(decoder, buffer, final=True)
+        self.assertEqual(decode_items(decoder, ', {"a": 1} ]', True),
+                         ([{'a': 1}], 11))
+
+    def test_json_read_boundaries(self):
+        content = json.dumps(self.items, ensure_ascii=False, indent=1)
+        for read_size in (1, 2, 3, 7, 64, len(content)):
+            with self.subTest(read_size=read_size), mock.patch(
+                    'recipes.importers.READ_SIZE', read_size):
+                self.assertEqual(self.read(content, 'json'), self.expected)
+        self.assertEqual(self.read(' [ ] ', 'json'), [])
+        with self.assertRaises(ValueError):
+            self.read('{"name": "Соль"}', 'json')
+
+    def test_ndjson_and_csv(self):
+        ndjson = '\n'.join(json.dumps(item, ensure_ascii=False)
+                           for item in self.items) + '\n\n'
+        self.assertEqual(self.read(ndjson, 'ndjson'), self.expected)
+        csv = ('Соль,г\n"Перец, ""чёрный"" [молотый]",г\n'
+               'Сахар {тростниковый},кг\n,г\nБез единицы\n'
+               'Масло\u2028сливочное,г\n')
+        self.assertEqual(self.read(csv, 'csv'), self.expected)
+
+    def test_import_is_idempotent(self):
+        rows = self.expected + [self.expected[0]]
+        self.assertEqual(list(import_ingredients(rows, 2)),
+                         [(2, 2), (2, 2), (1, 0)])
+        self.assertEqual(list(import_ingredients(rows, 2)),
+                         [(2, 0), (2, 0), (1, 0)])
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', 'measurement_unit')),
+            set(self.expected))
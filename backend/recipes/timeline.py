@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, Subquery
+
+from users.models import Subscription, User
+
+from .models import Recipe, TimelineEntry
+
+BATCH_SIZE = 1000
+TRIM_SQL = '''
+    DELETE FROM {table} WHERE id IN (
+        SELECT entry.id FROM {table} entry
+        JOIN {table} cutoff ON entry.user_id = cutoff.user_id
+        WHERE cutoff.id IN ({cutoff_ids})
+        AND entry.pub_date <= cutoff.pub_date
+        AND (entry.pub_date < cutoff.pub_date
+             OR entry.recipe_id <= cutoff.recipe_id)
+    )
+'''
+
+
+def is_fanned_out(author):
+    """Whether new recipes of the author are pushed to subscribers."""
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    return Subscription.objects.filter(
+        subscription=author).values('id')[:limit + 1].count() <= limit
+
+
+def push_recipe(recipe):
+    """
+    Adds a new recipe to the timelines of the author's subscribers.
+
+    Recipes of authors with too many subscribers are left to be read
+    from the recipes table by their subscribers instead. Timelines of
+    the subscribers are trimmed back to TIMELINE_MAX_SIZE afterwards.
+    """
+    if not is_fanned_out(recipe.author_id):
+        return
+    subscriber_ids = list(Subscription.objects.filter(
+        subscription=recipe.author_id
+    ).values_list('subscriber_id', flat=True))
+    with transaction.atomic():
+        TimelineEntry.objects.bulk_create(
+            (TimelineEntry(user_id=user_id, recipe_id=recipe.id,
+                           author_id=recipe.author_id,
+                           pub_date=recipe.pub_date)
+             for user_id in subscriber_ids),
+            batch_size=BATCH_SIZE, ignore_conflicts=True
+        )
+        Recipe.objects.filter(id=recipe.id).update(fanned_out=True)
+        trim(subscriber_ids)
+
+
+def backfill(user, author_ids):
+    """Adds pushed recipes of newly followed authors to the timeline."""
+    recipes = Recipe.objects.filter(
+        author_id__in=author_ids, fanned_out=True
+    ).order_by('-pub_date', '-id').values_list('id', 'author_id', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user.id, recipe_id=recipe_id,
+                       author_id=author_id, pub_date=pub_date)
+         for recipe_id, author_id, pub_date
+         in recipes[:settings.TIMELINE_MAX_SIZE]),
+        batch_size=BATCH_SIZE, ignore_conflicts=True
+    )
+    trim([user.id])
+
+
+def remove_authors(user, author_ids):
+    TimelineEntry.objects.filter(user_id=user.id,
+                                 author_id__in=author_ids).delete()
+
+
+def get_cutoff_ids(user_ids):
+    """
+    Ids of the first entries beyond TIMELINE_MAX_SIZE of the timelines
+    that are over the limit.
+    """
+    overflow = TimelineEntry.objects.filter(
+        user=OuterRef('pk')
+    ).order_by('-pub_date', '-recipe_id').values('id')[
+        settings.TIMELINE_MAX_SIZE:settings.TIMELINE_MAX_SIZE + 1]
+    return [
+        entry_id for entry_id in User.objects.filter(
+            id__in=user_ids
+        ).annotate(overflow=Subquery(overflow)).values_list(
+            'overflow', flat=True)
+        if entry_id is not None
+    ]
+
+
+def trim(user_ids):
+    """
+    Drops entries beyond TIMELINE_MAX_SIZE from the timelines.
+
+    Only timelines over the limit are touched: each index scan stops at
+    the first entry beyond the limit, which and all older entries of
+    its timeline are deleted.
+    """
+    user_ids = list(user_ids)
+    table = connection.ops.quote_name(TimelineEntry._meta.db_table)
+    deleted = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(user_ids), BATCH_SIZE):
+            cutoff_ids = get_cutoff_ids(user_ids[start:start + BATCH_SIZE])
+            if not cutoff_ids:
+                continue
+            cursor.execute(
+                TRIM_SQL.format(
+                    table=table,
+                    cutoff_ids=', '.join(['%s'] * len(cutoff_ids))),
+                cutoff_ids
+            )
+            deleted += cursor.rowcount
+    return deleted
+
+
+def trim_all():
+    return trim(TimelineEntry.objects.values('user').annotate(
+        entries=Count('id')
+    ).filter(entries__gt=settings.TIMELINE_MAX_SIZE).values_list(
+        'user', flat=True))
+
+
+def get_sources(user):
+    """
+    Querysets of (pub_date, recipe id) that make up the user's timeline.
+
+    Pushed entries come from the timeline table, recipes of authors with
+    too many subscribers are read from the recipes table.
+    """
+    return (
+        (TimelineEntry.objects.filter(user_id=user.id).values_list(
+            'pub_date', 'recipe_id'), ('-pub_date', '-recipe_id')),
+        (Recipe.objects.filter(
+            fanned_out=False,
+            author__in=Subscription.objects.filter(
+                subscriber_id=user.id).values('subscription')
+        ).values_list('pub_date', 'id'), ('-pub_date', '-id')),
+    )
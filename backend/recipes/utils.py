@@ -0,0 +1,79 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+class LazyIndex:
+    """
+    Process-local index built on first use.
+
+    It is rebuilt after invalidate(). Once it is older than the ttl
+    setting, which bounds staleness in other worker processes, it is
+    rebuilt in a background thread and the old one is served meanwhile.
+    update() applies a change to the built index, changes made while a
+    rebuild runs are applied to the new index as well.
+    """
+
+    def __init__(self, build, ttl_setting):
+        self.build = build
+        self.ttl_setting = ttl_setting
+        self._index = None
+        self._built_at = 0
+        self._generation = 0
+        self._pending = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._generation += 1
+
+    def update(self, change):
+        """Replaces the index with `change(index)` if it is built."""
+        with self._lock:
+            if self._index is not None:
+                self._index = change(self._index)
+            if self._pending is not None:
+                self._pending.append(change)
+
+    def get(self):
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self.build()
+                    self._built_at = time.monotonic()
+                return self._index
+        ttl = getattr(settings, self.ttl_setting)
+        if time.monotonic() - self._built_at > ttl:
+            self.refresh()
+        return index
+
+    def refresh(self):
+        """Starts a background rebuild unless one is running."""
+        with self._lock:
+            if self._pending is not None:
+                return None
+            self._pending = []
+            generation = self._generation
+        self._thread = threading.Thread(target=self._rebuild,
+                                        args=(generation,), daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def _rebuild(self, generation):
+        index = None
+        try:
+            index = self.build()
+        finally:
+            connections.close_all()
+            with self._lock:
+                pending, self._pending = self._pending, None
+                if index is not None and generation == self._generation:
+                    for change in pending:
+                        index = change(index)
+                    self._index = index
+                    self._built_at = time.monotonic()
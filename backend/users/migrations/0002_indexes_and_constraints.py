@@ -0,0 +1,32 @@
+# Generated by Django 3.2 on 2026-10-17 22:25
+
+import django.db.models.expressions
+from django.db import migrations, models
+from django.db.models import F, Min
+
+
+def deduplicate(apps, schema_editor):
+    Subscription = apps.get_model('users', 'Subscription')
+    Subscription.objects.filter(subscriber=F('subscription')).delete()
+    keep = Subscription.objects.values('subscriber', 'subscription').annotate(
+        keep_id=Min('id')).values_list('keep_id', flat=True).order_by()
+    Subscription.objects.exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.UniqueConstraint(fields=('subscriber', 'subscription'), name='unique_subscription'),
+        ),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.CheckConstraint(check=models.Q(_negated=True, subscriber=django.db.models.expressions.F('subscription')), name='no_self_subscription'),
+        ),
+    ]
@@ -67,6 +67,16 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = 'Subscription'
         verbose_name_plural = 'Subscriptions'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('subscriber', 'subscription'),
+                name='unique_subscription'
+            ),
+            models.CheckConstraint(
+                check=~models.Q(subscriber=models.F('subscription')),
+                name='no_self_subscription'
+            )
+        ]
 
     def __str__(self):
         return f'{self.subscriber} subsribed for {self.subscription}.'